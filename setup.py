@@ -60,7 +60,7 @@ setup(
     include_package_data = True,
     entry_points = {
     	'console_scripts': [
-    		'udoc = uberdoc.udoc:main'
+    		'udoc = uberdoc.client:main'
     	]
     },
     install_requires=['jinja2']
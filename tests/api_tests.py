@@ -0,0 +1,191 @@
+from __future__ import print_function
+from nose.tools import *
+from uberdoc import api
+from uberdoc.udoc import Uberdoc, Config, BuildResult
+from . import fake_pandoc
+import os
+import sys
+import json
+from os import path
+import shutil
+import stat
+from multiprocessing.pool import ThreadPool
+
+# adds a paragraph naming the output format and chapter
+MARK_FILTER = """
+def mark(doc, fmt, chapter):
+    doc["blocks"].append({"t": "Para", "c": [{"t": "Str", "c": fmt + ":" + chapter}]})
+"""
+
+# adds a paragraph with its working dir and PANDOC_VERSION
+WHERE_FILTER = """#!%s
+import json, os, sys
+doc = json.load(sys.stdin)
+text = os.getcwd() + " " + os.environ.get("PANDOC_VERSION", "")
+doc["blocks"].append({"t": "Para", "c": [{"t": "Str", "c": text}]})
+json.dump(doc, sys.stdout)
+""" % sys.executable
+
+
+class TestApi:
+    BUILD_DIR = "testbuild"
+    TEST_CONF_FILE = "tests/uberdoc_tests.cfg"
+    BIN_DIR = path.abspath(path.join(BUILD_DIR, "bin"))
+
+    def setup(self):
+        if path.isdir(self.BUILD_DIR):
+            shutil.rmtree(self.BUILD_DIR)
+        fake_pandoc.install(self.BIN_DIR)
+        self.old_path = os.environ["PATH"]
+        os.environ["PATH"] = self.BIN_DIR + os.pathsep + self.old_path
+        for name in ("doc1", "doc2"):
+            doc_dir = path.join(self.BUILD_DIR, name)
+            os.mkdir(doc_dir)
+            conf = Config(self.TEST_CONF_FILE)
+            conf["doc_dir"] = doc_dir
+            Uberdoc(conf, output=None).init_doc()
+
+    def teardown(self):
+        os.environ["PATH"] = self.old_path
+
+    @with_setup(setup, teardown)
+    def test_load_config(self):
+        conf = api.load_config(path.join(self.BUILD_DIR, "doc1", "uberdoc.cfg"))
+        assert_equals(conf["doc_dir"], path.abspath(path.join(self.BUILD_DIR, "doc1")))
+
+    @with_setup(setup, teardown)
+    def test_concurrent_builds(self):
+        cwd = os.getcwd()
+        environ = dict(os.environ)
+        messages = []
+        cfg_files = [path.join(self.BUILD_DIR, name, "uberdoc.cfg")
+                     for name in ("doc1", "doc2", "doc1")]
+        pool = ThreadPool(3)
+        try:
+            results = pool.map(
+                lambda cfg_file: api.build(cfg_file,
+                    output=lambda msg, color=None: messages.append(msg)),
+                cfg_files)
+        finally:
+            pool.close()
+
+        assert_equals(os.getcwd(), cwd)
+        assert_equals(dict(os.environ), environ)
+        assert_true(len(messages) > 0)
+        for cfg_file, result in zip(cfg_files, results):
+            assert_true(isinstance(result, BuildResult))
+            assert_true(result.ok, result.errors)
+            html = path.join(path.dirname(path.abspath(cfg_file)), "out", "concept.html")
+            assert_equals(result.outputs, [html])
+            assert_true(path.isfile(html))
+            assert_true(result.timings["total"] > 0)
+
+    @with_setup(setup, teardown)
+    def test_cmd_env(self):
+        conf = api.load_config(path.join(self.BUILD_DIR, "doc1", "uberdoc.cfg"))
+        u = Uberdoc(conf, output=None)
+        returncode, out, error = u.cmd('sh -c "echo $UDOC_TEST_VAR"',
+            env=[("UDOC_TEST_VAR", "set")])
+        assert_equals(out.strip(), "set")
+        assert_false("UDOC_TEST_VAR" in os.environ)
+
+    @with_setup(setup, teardown)
+    def test_failed_build_keeps_output(self):
+        cfg_file = path.join(self.BUILD_DIR, "doc1", "uberdoc.cfg")
+        html = path.join(self.BUILD_DIR, "doc1", "out", "concept.html")
+        result = api.build(cfg_file)
+        assert_true(result.ok)
+        assert_equals(result.outputs, [path.abspath(html)])
+
+        with open(html) as f:
+            content = f.read()
+
+        open(path.join(self.BIN_DIR, "pandoc.fail"), "w").close()
+        result = api.build(cfg_file)
+        assert_false(result.ok)
+        assert_equals(result.outputs, [])
+        with open(html) as f:
+            assert_equals(f.read(), content)
+
+    @with_setup(setup, teardown)
+    def test_template_error(self):
+        with open(path.join(self.BUILD_DIR, "doc1", "in", "chapter1", "chapter1.md"), "a") as f:
+            f.write("\n{% if %}\n")
+        result = api.build(path.join(self.BUILD_DIR, "doc1", "uberdoc.cfg"))
+        assert_false(result.ok)
+        assert_true("TemplateSyntaxError" in result.errors[0])
+        assert_equals(result.outputs, [])
+
+    @with_setup(setup, teardown)
+    def test_filters(self):
+        doc_dir = path.join(self.BUILD_DIR, "doc1")
+        os.mkdir(path.join(doc_dir, "filters"))
+        with open(path.join(doc_dir, "filters", "mark.py"), "w") as f:
+            f.write(MARK_FILTER)
+        # chapters with the same content are still filtered separately
+        for chapter in ("chapter1", "chapter2"):
+            with open(path.join(doc_dir, "in", chapter, chapter + ".md"), "w") as f:
+                f.write("# Same\n")
+        conf = api.load_config(path.join(doc_dir, "uberdoc.cfg"))
+        conf["filters"] = "filters/mark.py:mark"
+        # each format is filtered for itself
+        conf["formats"] = "html epub"
+
+        for cached in (False, True):
+            result = api.build(conf)
+            assert_true(result.ok, result.errors)
+            assert_equals(result.metrics.get("cache.filters.hit", 0), 6 if cached else 0)
+            for fmt in ("html", "epub"):
+                with open(path.join(doc_dir, "out", "concept." + fmt)) as f:
+                    doc = json.load(f)
+                assert_equals([block["c"][0]["c"] for block in doc["blocks"]],
+                    [fmt + ":chapter1/chapter1.md", fmt + ":chapter2/chapter2.md",
+                     fmt + ":templating/templating.md"])
+
+    @with_setup(setup, teardown)
+    def test_draft_links(self):
+        doc_dir = path.join(self.BUILD_DIR, "doc1")
+        with open(path.join(doc_dir, "in", "chapter2", "chapter2.md"), "a") as f:
+            f.write("\nSee [chapter 1](#chapter-1) and [nowhere](#nowhere).\n")
+        # chapter1 isn't indexed yet, it's indexed for the draft's links
+        result = api.build(path.join(doc_dir, "uberdoc.cfg"), only=["chapter2"])
+        assert_true(result.ok, result.errors)
+        assert_equals([w for w in result.warnings if "anchor" in w],
+            ["chapter2/chapter2.md:24: unknown anchor #nowhere"])
+
+    @with_setup(setup, teardown)
+    def test_filter_module_reload(self):
+        doc_dir = path.abspath(path.join(self.BUILD_DIR, "doc1"))
+        conf = api.load_config(path.join(doc_dir, "uberdoc.cfg"))
+        conf["filters"] = "udoc_test_filter:mark"
+        sys.path.insert(0, doc_dir)
+        try:
+            # edited filter modules are picked up within one process
+            for version in ("VERSION-ONE", "VERSION-TWO-EDITED"):
+                with open(path.join(doc_dir, "udoc_test_filter.py"), "w") as f:
+                    f.write(MARK_FILTER.replace("fmt + \":\" + chapter", repr(version)))
+                result = api.build(conf)
+                assert_true(result.ok, result.errors)
+                with open(path.join(doc_dir, "out", "concept.html")) as f:
+                    doc = json.load(f)
+                assert_equals(doc["blocks"][0]["c"][0]["c"], version)
+        finally:
+            sys.path.remove(doc_dir)
+            sys.modules.pop("udoc_test_filter", None)
+
+    @with_setup(setup, teardown)
+    def test_executable_filter_env(self):
+        doc_dir = path.abspath(path.join(self.BUILD_DIR, "doc1"))
+        where = path.join(doc_dir, "filters", "where")
+        os.mkdir(path.dirname(where))
+        with open(where, "w") as f:
+            f.write(WHERE_FILTER)
+        os.chmod(where, stat.S_IRWXU)
+        conf = api.load_config(path.join(doc_dir, "uberdoc.cfg"))
+        conf["filters"] = "filters/where"
+        result = api.build(conf)
+        assert_true(result.ok, result.errors)
+        with open(path.join(doc_dir, "out", "concept.html")) as f:
+            doc = json.load(f)
+        assert_equals(doc["blocks"][0]["c"][0]["c"],
+            path.join(doc_dir, ".udoc_staging", "full", "in") + " 2.19.2")
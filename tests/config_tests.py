@@ -30,3 +30,9 @@ class TestConfig:
 
 		c_user = Config(self.TEST_CONF_FILE_USER)
 		assert_equals(len(c_user.user_items()), 2)
+
+	def test_get(self):
+		c = Config(self.TEST_CONF_FILE)
+		assert_equals(c.get("in_dir"), "in")
+		assert_equals(c.get("not_there"), None)
+		assert_equals(c.get("not_there", "default"), "default")
@@ -0,0 +1,107 @@
+from __future__ import print_function
+from nose.tools import *
+from uberdoc import daemon
+from uberdoc.udoc import Uberdoc, Config
+from . import fake_pandoc
+import os
+from os import path
+import io
+import shutil
+import stat
+import threading
+
+
+class TestDaemon:
+    BUILD_DIR = "testbuild"
+    TEST_CONF_FILE = "tests/uberdoc_tests.cfg"
+    SOCKET = path.abspath(path.join(BUILD_DIR + "-daemon.sock"))
+
+    def setup(self):
+        if path.isdir(self.BUILD_DIR):
+            shutil.rmtree(self.BUILD_DIR)
+        os.mkdir(self.BUILD_DIR)
+        conf = Config(self.TEST_CONF_FILE)
+        conf['doc_dir'] = path.abspath(self.BUILD_DIR)
+        Uberdoc(conf).init_doc()
+
+    def start(self):
+        server = daemon.create(self.SOCKET)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def stop(self, server):
+        server.shutdown()
+        server.server_close()
+        os.remove(self.SOCKET)
+
+    @with_setup(setup)
+    def test_forward_without_daemon(self):
+        assert_equals(daemon.forward(["clean"], sock_file=self.SOCKET), None)
+
+    @with_setup(setup)
+    def test_forward(self):
+        out_dir = path.join(self.BUILD_DIR, "out")
+        os.mkdir(out_dir)
+        server = self.start()
+        try:
+            cwd = os.getcwd()
+            code = daemon.forward(["clean"], cwd=self.BUILD_DIR, sock_file=self.SOCKET)
+            assert_equals(code, 0)
+            assert_false(path.isdir(out_dir))
+            assert_equals(os.getcwd(), cwd)
+
+            code = daemon.forward(["nosuchcommand"], cwd=self.BUILD_DIR, sock_file=self.SOCKET)
+            assert_equals(code, 2)
+
+            # the instance is kept warm between commands
+            daemon.forward(["clean"], cwd=self.BUILD_DIR, sock_file=self.SOCKET)
+            assert_equals(len(server.docs), 1)
+        finally:
+            self.stop(server)
+
+    @with_setup(setup)
+    def test_without_unix_sockets(self):
+        daemon.AVAILABLE = False
+        try:
+            assert_equals(daemon.forward(["clean"], sock_file=self.SOCKET), None)
+            assert_raises(SystemExit, daemon.serve)
+        finally:
+            daemon.AVAILABLE = True
+
+    @with_setup(setup)
+    def test_foreign_socket(self):
+        server = self.start()
+        getuid = os.getuid
+        os.getuid = lambda: getuid() + 1
+        try:
+            assert_equals(daemon.forward(["clean"], sock_file=self.SOCKET), None)
+            assert_raises(SystemExit, daemon.create, self.SOCKET)
+        finally:
+            os.getuid = getuid
+            self.stop(server)
+
+    @with_setup(setup)
+    def test_private_dir(self):
+        adir = path.join(self.BUILD_DIR, "run")
+        assert_equals(daemon._private_dir(adir), None)
+        assert_equals(stat.S_IMODE(os.stat(adir).st_mode), 0o700)
+        os.chmod(adir, 0o755)
+        assert_not_equal(daemon._private_dir(adir), None)
+
+    @with_setup(setup)
+    def test_client_path(self):
+        bin_dir = path.abspath(path.join(self.BUILD_DIR, "bin"))
+        pandoc = fake_pandoc.install(bin_dir)
+
+        server = self.start()
+        try:
+            old_path = os.environ["PATH"]
+            out = io.StringIO()
+            server.run(path.abspath(self.BUILD_DIR), ["check"], out, io.StringIO(),
+                       bin_dir + os.pathsep + old_path)
+            assert_true("pandoc: " + pandoc in out.getvalue())
+            assert_equals(os.environ["PATH"], old_path)
+        finally:
+            self.stop(server)
@@ -0,0 +1,146 @@
+from __future__ import print_function
+from nose.tools import *
+from uberdoc import filters
+import os
+from os import path
+import shutil
+import stat
+import sys
+import types
+
+PYTHON_FILTER = """
+def upper(doc, fmt, chapter):
+    for block in doc["blocks"]:
+        for inline in block["c"]:
+            if inline["t"] == "Str":
+                inline["c"] = inline["c"].upper()
+"""
+
+EXECUTABLE_FILTER = """#!%s
+import json, sys
+doc = json.load(sys.stdin)
+doc["meta"]["format"] = {"t": "MetaString", "c": sys.argv[1]}
+json.dump(doc, sys.stdout)
+""" % sys.executable
+
+
+def chapter_doc(text):
+    return {"pandoc-api-version": [1, 22], "meta": {},
+            "blocks": [{"t": "Para", "c": [{"t": "Str", "c": text}]}]}
+
+
+class TestFilters:
+    BUILD_DIR = path.abspath("testbuild")
+
+    def setup(self):
+        if path.isdir(self.BUILD_DIR):
+            shutil.rmtree(self.BUILD_DIR)
+        os.makedirs(path.join(self.BUILD_DIR, "filters"))
+        self.write("filters/upper.py", PYTHON_FILTER)
+        self.write("filters/meta", EXECUTABLE_FILTER)
+        os.chmod(path.join(self.BUILD_DIR, "filters", "meta"), stat.S_IRWXU)
+
+    def write(self, name, content):
+        with open(path.join(self.BUILD_DIR, name), "w") as f:
+            f.write(content)
+
+    @with_setup(setup)
+    def test_apply(self):
+        chapter_filters = filters.load_filters(
+            ["filters/upper.py:upper", "filters/meta"], self.BUILD_DIR)
+        assert_true(isinstance(chapter_filters[0], filters.PythonFilter))
+        assert_true(isinstance(chapter_filters[1], filters.ExecutableFilter))
+        doc = filters.apply_filters(chapter_doc("hello"), chapter_filters, "html", "c1/c1.md")
+        assert_equals(doc["blocks"][0]["c"][0]["c"], "HELLO")
+        assert_equals(doc["meta"]["format"]["c"], "html")
+
+    @with_setup(setup)
+    def test_errors(self):
+        assert_raises(filters.FilterError, filters.load_filters,
+            ["filters/upper.py:nope"], self.BUILD_DIR)
+        assert_raises(filters.FilterError, filters.load_filters,
+            ["udoc-no-such-filter"], self.BUILD_DIR)
+        self.write("filters/fail", "#!/bin/sh\necho broken >&2\nexit 1\n")
+        os.chmod(path.join(self.BUILD_DIR, "filters", "fail"), stat.S_IRWXU)
+        failing = filters.load_filters(["filters/fail"], self.BUILD_DIR)
+        assert_raises(filters.FilterError, filters.apply_filters,
+            chapter_doc("x"), failing, "html", "c1/c1.md")
+
+        # e.g. namespace packages have no __file__
+        module = types.ModuleType("udoc_test_no_file")
+        module.__file__ = None
+        module.upper = lambda doc, fmt, chapter: doc
+        sys.modules[module.__name__] = module
+        try:
+            assert_raises(filters.FilterError, filters.load_filters,
+                ["udoc_test_no_file:upper"], self.BUILD_DIR)
+        finally:
+            del sys.modules[module.__name__]
+
+    @with_setup(setup)
+    def test_cache_key(self):
+        chapter_filters = filters.load_filters(["filters/upper.py:upper"], self.BUILD_DIR)
+        key = filters.cache_key("# c1", chapter_filters, "html")
+        assert_equals(key, filters.cache_key("# c1", chapter_filters, "html"))
+        assert_not_equal(key, filters.cache_key("# c1 changed", chapter_filters, "html"))
+        assert_not_equal(key, filters.cache_key("# c1", chapter_filters, "pdf"))
+        assert_not_equal(key, filters.cache_key("# c1", [], "html"))
+
+        self.write("filters/upper.py", PYTHON_FILTER + "\n# changed\n")
+        changed = filters.load_filters(["filters/upper.py:upper"], self.BUILD_DIR)
+        assert_not_equal(key, filters.cache_key("# c1", changed, "html"))
+
+    @with_setup(setup)
+    def test_filter_cache(self):
+        cache_dir = path.join(self.BUILD_DIR, "cache")
+        cache = filters.FilterCache(cache_dir)
+        assert_equals(cache.get("c1/c1.md", "html", "abc"), None)
+        cache.put("c1/c1.md", "html", "abc", chapter_doc("x"))
+        assert_equals(cache.get("c1/c1.md", "html", "abc"), chapter_doc("x"))
+        assert_equals(cache.get("c1/c1.md", "pdf", "abc"), None)
+
+        # a chapter's new document replaces its old one
+        cache.put("c1/c1.md", "html", "def", chapter_doc("y"))
+        assert_equals(cache.get("c1/c1.md", "html", "abc"), None)
+        assert_equals(cache.get("c1/c1.md", "html", "def"), chapter_doc("y"))
+        cache.put("c2/c2.md", "html", "abc", chapter_doc("z"))
+        assert_equals(len(os.listdir(cache_dir)), 2)
+
+        # slots unused for max_age days are pruned
+        slot = cache._slot("c2/c2.md", "html")
+        os.utime(path.join(slot, "abc.json"), (1, 1))
+        cache.prune()
+        assert_false(path.isdir(slot))
+        assert_equals(cache.get("c1/c1.md", "html", "def"), chapter_doc("y"))
+
+        no_cache = filters.FilterCache(None)
+        no_cache.put("c1/c1.md", "html", "abc", chapter_doc("x"))
+        assert_equals(no_cache.get("c1/c1.md", "html", "abc"), None)
+        no_cache.prune()
+
+    def test_merge_docs(self):
+        doc1 = chapter_doc("one")
+        doc1["meta"]["title"] = {"t": "MetaString", "c": "first"}
+        doc2 = chapter_doc("two")
+        doc2["meta"]["title"] = {"t": "MetaString", "c": "second"}
+        merged = filters.merge_docs([doc1, doc2])
+        assert_equals(merged["meta"]["title"]["c"], "first")
+        assert_equals([b["c"][0]["c"] for b in merged["blocks"]], ["one", "two"])
+        assert_equals(merged["pandoc-api-version"], [1, 22])
+
+    def test_merge_docs_ids(self):
+        def header(ident):
+            return {"t": "Header", "c": [1, [ident, [], []], [{"t": "Str", "c": ident}]]}
+
+        def ids(doc):
+            return [block["c"][1][0] for block in doc["blocks"]]
+
+        doc1 = {"pandoc-api-version": [1, 22], "meta": {},
+                "blocks": [header("intro"), header("setup")]}
+        doc2 = {"pandoc-api-version": [1, 22], "meta": {},
+                "blocks": [header("intro"), header("intro-1"), header("usage")]}
+        doc3 = {"pandoc-api-version": [1, 22], "meta": {},
+                "blocks": [header("intro"), header("setup-2")]}
+        merged = filters.merge_docs([doc1, doc2, doc3])
+        assert_equals(ids(merged), ["intro", "setup", "intro-1", "intro-2", "usage",
+                                    "intro-3", "setup-2"])
@@ -0,0 +1,69 @@
+from __future__ import print_function
+from nose.tools import *
+from uberdoc.links import LinkIndex, auto_identifier, scan
+import os
+from os import path
+import shutil
+import io
+
+
+class TestLinks:
+    BUILD_DIR = "testbuild"
+    INDEX_FILE = path.join(BUILD_DIR, "links.json")
+
+    def setup(self):
+        if path.isdir(self.BUILD_DIR):
+            shutil.rmtree(self.BUILD_DIR)
+        os.makedirs(path.join(self.BUILD_DIR, "c1", "img"))
+        os.makedirs(path.join(self.BUILD_DIR, "c2"))
+        with open(path.join(self.BUILD_DIR, "c1", "img", "star.png"), "w") as f:
+            f.write("png")
+        self.write("c1/c1.md", "# Intro\n\nSee [c2](#intro-1) and [x](#nope).\n\n"
+                               "![star](c1/img/star)\n![gone](c1/img/gone.png)\n")
+        self.write("c2/c2.md", "# Intro\n\nBack to [c1](#intro) or [web](http://x.org/#a).\n")
+
+    def write(self, name, content):
+        with io.open(path.join(self.BUILD_DIR, name), "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def test_auto_identifier(self):
+        assert_equals(auto_identifier("Heading identifiers in HTML"), "heading-identifiers-in-html")
+        assert_equals(auto_identifier("*Dogs*?--in *my* house?"), "dogs--in-my-house")
+        assert_equals(auto_identifier("[HTML], [S5], or [RTF]?"), "html-s5-or-rtf")
+        assert_equals(auto_identifier("3. Applications"), "applications")
+        assert_equals(auto_identifier("33"), "section")
+
+    def test_scan(self):
+        headings, anchors, links = scan(
+            "Title\n=====\n\n## Setup {#setup .unnumbered}\n\n"
+            "[span]{#here} <a name=\"old\"></a>\n\n"
+            "```\n# not a heading [x](#code)\n```\n\n"
+            "`[y](#inline)` [z](#setup \"title\")\n\n[ref]: #here\n")
+        assert_equals(headings, [(None, "title"), ("setup", "setup")])
+        assert_equals(sorted(anchors), ["here", "old"])
+        assert_equals(links, [("#setup", 12, False), ("#here", 14, False)])
+
+    @with_setup(setup)
+    def test_broken(self):
+        index = LinkIndex(self.INDEX_FILE)
+        chapters = ["c1/c1.md", "c2/c2.md"]
+        for chapter in chapters:
+            with io.open(path.join(self.BUILD_DIR, chapter), encoding="utf-8") as f:
+                index.update(chapter, f.read(), [chapter], self.BUILD_DIR)
+        broken = index.broken(chapters, chapters, self.BUILD_DIR)
+        assert_equals(broken, [("c1/c1.md", 3, "#nope", "unknown anchor"),
+                               ("c1/c1.md", 6, "c1/img/gone.png", "missing image")])
+        assert_equals(len(index.broken(["c1/c1.md"], ["c1/c1.md"], self.BUILD_DIR)), 3)
+
+    @with_setup(setup)
+    def test_persistence(self):
+        index = LinkIndex(self.INDEX_FILE)
+        assert_false(index.is_fresh("c2/c2.md", self.BUILD_DIR))
+        index.update("c2/c2.md", "# Intro\n", ["c2/c2.md"], self.BUILD_DIR)
+        index.save()
+
+        index = LinkIndex(self.INDEX_FILE)
+        assert_true(index.is_fresh("c2/c2.md", self.BUILD_DIR))
+        assert_equals(index.anchors(["c2/c2.md"]), set(["intro"]))
+        self.write("c2/c2.md", "# Changed intro\n")
+        assert_false(index.is_fresh("c2/c2.md", self.BUILD_DIR))
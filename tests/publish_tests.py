@@ -0,0 +1,72 @@
+from __future__ import print_function
+from nose.tools import *
+from uberdoc.publish import publish_tree, atomic_write
+import os
+from os import path
+import shutil
+from multiprocessing.pool import ThreadPool
+
+
+class TestPublish:
+    BUILD_DIR = "testbuild"
+    STAGING_DIR = path.join(BUILD_DIR, "staging")
+    OUT_DIR = path.join(BUILD_DIR, "out")
+
+    def setup(self):
+        if path.isdir(self.BUILD_DIR):
+            shutil.rmtree(self.BUILD_DIR)
+        os.mkdir(self.BUILD_DIR)
+
+    def stage(self, files):
+        if path.isdir(self.STAGING_DIR):
+            shutil.rmtree(self.STAGING_DIR)
+        for name, content in files.items():
+            afile = path.join(self.STAGING_DIR, name)
+            if not path.isdir(path.dirname(afile)):
+                os.makedirs(path.dirname(afile))
+            with open(afile, "w") as f:
+                f.write(content)
+
+    def read(self, name):
+        with open(path.join(self.OUT_DIR, name)) as f:
+            return f.read()
+
+    @with_setup(setup)
+    def test_publish(self):
+        self.stage({"doc.html": "v1", "img/a.png": "a", "old.txt": "old"})
+        assert_equals(publish_tree(self.STAGING_DIR, self.OUT_DIR), (3, 0, 0))
+        assert_equals(self.read("doc.html"), "v1")
+
+        os.utime(path.join(self.OUT_DIR, "img", "a.png"), (1, 1))
+        self.stage({"doc.html": "v2", "img/a.png": "a"})
+        assert_equals(publish_tree(self.STAGING_DIR, self.OUT_DIR), (1, 1, 1))
+        assert_equals(self.read("doc.html"), "v2")
+        assert_equals(os.stat(path.join(self.OUT_DIR, "img", "a.png")).st_mtime, 1)
+        assert_false(path.isfile(path.join(self.OUT_DIR, "old.txt")))
+
+    @with_setup(setup)
+    def test_keep(self):
+        self.stage({"doc.html": "v1"})
+        os.makedirs(path.join(self.OUT_DIR, "draft", "img"))
+        with open(path.join(self.OUT_DIR, "draft", "img", "x.png"), "w") as f:
+            f.write("x")
+        publish_tree(self.STAGING_DIR, self.OUT_DIR, keep=["draft"])
+        assert_true(path.isfile(path.join(self.OUT_DIR, "draft", "img", "x.png")))
+
+        self.stage({"doc.html": "v1"})
+        assert_equals(publish_tree(self.STAGING_DIR, self.OUT_DIR), (0, 1, 1))
+        assert_false(path.isdir(path.join(self.OUT_DIR, "draft")))
+
+    @with_setup(setup)
+    def test_atomic_write(self):
+        afile = path.join(self.BUILD_DIR, "index.json")
+        pool = ThreadPool(8)
+        try:
+            pool.map(lambda i: atomic_write(afile, u"%d\n" % i * 1000), range(32))
+        finally:
+            pool.close()
+        with open(afile) as f:
+            lines = f.read().splitlines()
+        assert_equals(len(lines), 1000)
+        assert_equals(len(set(lines)), 1)
+        assert_equals(os.listdir(self.BUILD_DIR), ["index.json"])
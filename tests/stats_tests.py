@@ -0,0 +1,83 @@
+from __future__ import print_function
+from nose.tools import *
+from uberdoc import stats
+from uberdoc.stats import Metrics
+import os
+from os import path
+import shutil
+from multiprocessing.pool import ThreadPool
+
+
+class TestStats:
+    BUILD_DIR = "testbuild"
+    DB_FILE = path.join(BUILD_DIR, "stats.db")
+
+    def setup(self):
+        if path.isdir(self.BUILD_DIR):
+            shutil.rmtree(self.BUILD_DIR)
+        os.mkdir(self.BUILD_DIR)
+
+    def record(self, preprocess, kind="full"):
+        m = Metrics()
+        m.add("phase.preprocess", preprocess)
+        m.add("phase.copy", 0.5)
+        m.add("total", preprocess + 0.5)
+        m.count_cache("version", True)
+        stats.record(self.DB_FILE, m, kind, "2014-01-01 (abc)")
+
+    @with_setup(setup)
+    def test_metrics(self):
+        m = Metrics()
+        with m.phase("copy"):
+            pass
+        with m.phase("copy"):
+            pass
+        m.add("bytes.rendered", 10)
+        m.add("bytes.rendered", 5)
+        m.count_cache("version", False)
+        assert_true(m.values["phase.copy"] >= 0)
+        assert_equals(m.values["bytes.rendered"], 15)
+        assert_equals(m.values["cache.version.miss"], 1)
+
+    def test_metrics_threads(self):
+        m = Metrics()
+        pool = ThreadPool(8)
+        try:
+            pool.map(lambda i: [m.add("count") for _ in range(1000)], range(8))
+        finally:
+            pool.close()
+        assert_equals(m.values["count"], 8000)
+
+    @with_setup(setup)
+    def test_history(self):
+        self.record(1.0)
+        self.record(2.0)
+        self.record(9.0, kind="draft")
+        builds = stats.history(self.DB_FILE, 10)
+        assert_equals(len(builds), 2)
+        started, version, values = builds[-1]
+        assert_equals(version, "2014-01-01 (abc)")
+        assert_equals(values["phase.preprocess"], 2.0)
+        assert_equals(len(stats.history(self.DB_FILE, 1)), 1)
+        assert_equals(len(stats.history(self.DB_FILE, 10, kind="draft")), 1)
+
+    @with_setup(setup)
+    def test_regressions(self):
+        for i in range(10):
+            self.record(1.0)
+        for i in range(5):
+            self.record(2.0)
+        slower = stats.regressions(stats.history(self.DB_FILE, 15), recent=5)
+        assert_equals([name for name, before, after in slower],
+            ["phase.preprocess", "total"])
+        assert_equals(slower[0][1:], (1.0, 2.0))
+        messages = []
+        stats.report(self.DB_FILE, lambda msg, color=None: messages.append((msg, color)))
+        assert_true(("Last builds:", "yellow") in messages)
+        assert_equals(messages[-1][1], None)
+        assert_true(messages[-1][0].startswith("  total"))
+
+    def test_percentile(self):
+        assert_equals(stats.percentile([3, 1, 2], 50), 2)
+        assert_equals(stats.percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 90), 9)
+        assert_equals(stats.percentile([5], 90), 5)
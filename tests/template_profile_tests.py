@@ -0,0 +1,36 @@
+from __future__ import print_function
+from nose.tools import *
+from uberdoc.template_profile import TemplateProfiler
+from jinja2 import DictLoader
+
+
+class TestTemplateProfile:
+
+    TEMPLATES = {
+        "chapter.md": "{% import 'macros.md' as m %}"
+                      "{% for i in range(3) %}{{ m.row(i) }}{% endfor %}"
+                      "{% include 'part.md' %}",
+        "macros.md": "{% macro row(i) %}| {{ i }} |\n{% endmacro %}",
+        "part.md": "{% macro local() %}x{% endmacro %}part {{ local() }}",
+    }
+
+    def test_profile(self):
+        profiler = TemplateProfiler()
+        env = profiler.environment(DictLoader(self.TEMPLATES))
+        content = env.get_template("chapter.md").render()
+        assert_equals(content, "| 0 |\n| 1 |\n| 2 |\npart x")
+
+        entries = profiler.entries
+        assert_equals(entries[("macro", "macros.md: row()")][0], 3)
+        assert_equals(entries[("macro", "macros.md: row()")][2], 18)
+        assert_equals(entries[("macro", "part.md: local()")][0], 1)
+        assert_equals(entries[("template", "part.md")][2], len("part x"))
+        assert_equals(entries[("template", "chapter.md")][2], len(content))
+
+        hottest = profiler.hottest()
+        assert_equals(hottest[0][1], "chapter.md")
+        assert_equals(len(profiler.hottest("macro")), 2)
+
+        messages = []
+        profiler.report(lambda msg, color=None: messages.append(msg))
+        assert_true(any("row()" in msg for msg in messages))
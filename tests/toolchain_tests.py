@@ -0,0 +1,56 @@
+from __future__ import print_function
+from nose.tools import *
+from uberdoc import toolchain
+from . import fake_pandoc
+import os
+from os import path
+import shutil
+
+
+class TestToolchain:
+    BUILD_DIR = path.abspath("testbuild")
+    BIN_DIR = path.join(BUILD_DIR, "bin")
+    CACHE_FILE = path.join(BUILD_DIR, "toolchain.json")
+    TOOLS = {"pandoc": "pandoc", "git": "git", "latex": "udoc-no-such-latex"}
+
+    def setup(self):
+        if path.isdir(self.BUILD_DIR):
+            shutil.rmtree(self.BUILD_DIR)
+        fake_pandoc.install(self.BIN_DIR)
+        self.old_path = os.environ["PATH"]
+        os.environ["PATH"] = self.BIN_DIR + os.pathsep + self.old_path
+
+    def teardown(self):
+        os.environ["PATH"] = self.old_path
+
+    def calls(self):
+        with open(path.join(self.BIN_DIR, "pandoc.calls")) as f:
+            return len(f.read().splitlines())
+
+    @with_setup(setup, teardown)
+    def test_probe(self):
+        tools = toolchain.probe(self.TOOLS, self.CACHE_FILE)
+        assert_false(tools.cached)
+        assert_equals(tools.path("pandoc"), path.join(self.BIN_DIR, "pandoc"))
+        assert_equals(tools.version("pandoc"), (2, 19, 2))
+        assert_equals(tools.path("latex"), None)
+        assert_equals(tools.version("latex"), ())
+        assert_true(tools.supports_output("epub"))
+        assert_false(tools.supports_output("docx"))
+        assert_true(tools.supports_option("--pdf-engine"))
+        assert_false(tools.supports_option("--latex-engine"))
+
+    @with_setup(setup, teardown)
+    def test_cache(self):
+        toolchain.probe(self.TOOLS, self.CACHE_FILE)
+        calls = self.calls()
+        tools = toolchain.probe(self.TOOLS, self.CACHE_FILE)
+        assert_true(tools.cached)
+        assert_equals(tools.version("pandoc"), (2, 19, 2))
+        assert_equals(self.calls(), calls)
+
+        # a changed executable invalidates the cache
+        os.utime(path.join(self.BIN_DIR, "pandoc"), (1, 1))
+        tools = toolchain.probe(self.TOOLS, self.CACHE_FILE)
+        assert_false(tools.cached)
+        assert_true(self.calls() > calls)
@@ -1,6 +1,7 @@
 from __future__ import print_function
 from nose.tools import *
-from uberdoc.udoc import Uberdoc, Config
+from uberdoc.udoc import Uberdoc, Config, UberdocError, _option_value, _set_image_extension, \
+    _strip_reader_options
 import os
 from os import path
 import shutil
@@ -54,6 +55,20 @@ class TestUberdoc:
         assert_equals(lines[0], "chapter1")
         assert_equals(lines[1], "chapter2")
 
+    @with_setup(setup)
+    def test_read_nested_toc(self):
+        self.u.init_doc()
+        with open(path.join(self.in_dir, self.conf["toc_filename"]), "w") as toc:
+            toc.write("part1\n  chapter1\n    section1\n\n  # comment\n  chapter2\npart2\n")
+        assert_equals(self.u.read_toc(), ["part1", "part1/chapter1",
+            "part1/chapter1/section1", "part1/chapter2", "part2"])
+        assert_equals(self.u.generate_file_list(["part1/chapter1"]),
+            ["part1/chapter1/chapter1.md"])
+
+        with open(path.join(self.in_dir, self.conf["toc_filename"]), "w") as toc:
+            toc.write("part1\n  !chapter1\n  chapter2\n")
+        assert_equals(self.u.read_toc(), ["part1/chapter1"])
+
     @with_setup(setup)
     def test_version_with_git(self):
         self.u.init_doc()
@@ -68,6 +83,15 @@ class TestUberdoc:
         version_str = version_str.rstrip()
         assert_true(version.endswith("(" + version_str + ")"))
 
+    @with_setup(setup)
+    def test_version_without_git(self):
+        self.u.init_doc()
+        for root, dirs, names in os.walk(self.in_dir):
+            for name in names:
+                os.utime(path.join(root, name), (86400 * 365, 86400 * 365))
+        # the date of the newest input file, not today's
+        assert_equals(self.u._input_date(), "1971-01-01")
+
     @with_setup(setup)
     def test_build_html(self):
         self.u.init_doc()
@@ -105,6 +129,31 @@ class TestUberdoc:
         print(path.join(self.out_dir, "style"))
         assert_true(path.isdir(path.join(self.out_dir, "style")))
 
+    @with_setup(setup)
+    def test_select_chapters(self):
+        self.u.init_doc()
+        toc = self.u.read_toc()
+        assert_equals(self.u.select_chapters(toc, ["chapter2"]), ["chapter2"])
+        assert_equals(self.u.select_chapters(toc, ["templating", "chapter*"]),
+            ["chapter1", "chapter2", "templating"])
+        assert_raises(UberdocError, self.u.select_chapters, toc, ["nope*"])
+
+    @with_setup(setup)
+    def test_copy_draft_dependencies(self):
+        self.u.init_doc()
+        draft = self.u.draft()
+        toc = ["templating"]
+        files = draft.generate_file_list(toc)
+        draft.clean(recreate_out = True)
+        draft.copy_draft_dependencies(toc, files)
+        draft_in_dir = path.join(draft.out_dir, self.conf["in_dir"])
+        assert_true(path.isfile(path.join(draft_in_dir, "templating", "templating.md")))
+        assert_true(path.isfile(path.join(draft_in_dir, "templating", "some.md")))
+        assert_false(path.isdir(path.join(draft_in_dir, "chapter1")))
+        assert_false(path.isdir(path.join(draft.out_dir, "chapter1")))
+        assert_true(path.isdir(path.join(draft.out_dir, "style")))
+        draft.preprocess(files)
+
     @with_setup(setup)
     def test_outline(self):
         self.u.init_doc()
@@ -117,6 +166,70 @@ class TestUberdoc:
         assert_true(path.isdir(path.join(self.in_dir, "chapter1")))
         assert_true(path.isdir(path.join(self.in_dir, "chapter2")))
 
+    @with_setup(setup)
+    def test_outline_nested(self):
+        self.u.init_doc()
+        toc = ["chapter1", "p1", "p1/c1", "p1/c1/s1"]
+        self.u.outline(toc = toc)
+        assert_true(path.isfile(path.join(self.in_dir, "p1", "p1.md")))
+        assert_true(path.isfile(path.join(self.in_dir, "p1", "c1", "s1", "s1.md")))
+        os.mkdir(path.join(self.in_dir, "p1", "stray"))
+        with open(path.join(self.in_dir, "p1", "stray", "stray.md"), "w") as f:
+            f.write("# stray\n")
+        # dirs without a chapter file belong to their chapter
+        os.mkdir(path.join(self.in_dir, "p1", "diagrams"))
+        assert_equals(self.u.scan_chapter_dirs(set(toc)),
+            set(["chapter1", "chapter2", "templating", "p1", "p1/c1", "p1/c1/s1", "p1/stray"]))
+
+    @with_setup(setup)
+    def test_output_formats(self):
+        assert_equals(self.u.output_formats(), ["html"])
+        assert_equals(self.u.output_formats(pdf = True), ["html", "pdf"])
+        self.conf["formats"] = "html, epub docx"
+        assert_equals(self.u.output_formats(pdf = True), ["html", "epub", "docx", "pdf"])
+        self.conf["formats"] = ""
+        assert_equals(self.u.output_formats(pdf = True), ["pdf"])
+        assert_raises(UberdocError, self.u.output_formats)
+
+    def test_strip_reader_options(self):
+        assert_equals(_strip_reader_options("-s --toc"), ("-s --toc", []))
+        options, removed = _strip_reader_options("-f markdown -s --from=rst -r textile --toc")
+        assert_equals(options.split(), ["-s", "--toc"])
+        assert_equals(removed, ["-f markdown", "--from=rst", "-r textile"])
+
+    def test_default_image_extension(self):
+        options = '-s --default-image-extension=pdf -V "a:b c"'
+        assert_equals(_option_value(options, "--default-image-extension"), "pdf")
+        assert_equals(_option_value("--default-image-extension png", "--default-image-extension"), "png")
+        assert_equals(_option_value("-s", "--default-image-extension"), None)
+
+        image = {"t": "Image", "c": [["", [], []], [], ["chapter1/img/star", ""]]}
+        other = {"t": "Image", "c": [["", [], []], [], ["chapter1/img/star.jpg", ""]]}
+        ast = {"meta": {}, "blocks": [{"t": "Para", "c": [image, other]}]}
+        _set_image_extension(ast, "pdf")
+        assert_equals(image["c"][-1][0], "chapter1/img/star.pdf")
+        assert_equals(other["c"][-1][0], "chapter1/img/star.jpg")
+
+    @with_setup(setup)
+    def test_check_links(self):
+        self.u.init_doc()
+        assert_equals(self.u.check_links(), [])
+        with open(path.join(self.in_dir, "chapter2", "chapter2.md"), "a") as f:
+            f.write("\n[broken](#no-such-heading)\n")
+        broken = self.u.check_links()
+        assert_equals(len(broken), 1)
+        assert_equals(broken[0][2], "#no-such-heading")
+
+    @with_setup(setup)
+    def test_profile_templates(self):
+        self.u.init_doc()
+        profiler = self.u.profile_templates(only = ["templating"])
+        assert_equals([row[1] for row in profiler.hottest("chapter")],
+            ["templating/templating.md"])
+        assert_equals(profiler.hottest("macro")[0][1],
+            "templating/templating.md: todo()")
+        assert_true(("template", "templating/some.md") in profiler.entries)
+
     def clean(self):
         if path.isdir(self.BUILD_DIR):
             shutil.rmtree(self.BUILD_DIR)
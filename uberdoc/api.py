@@ -0,0 +1,36 @@
+"""Library interface for building documents from other programs, e.g.
+
+    from uberdoc.api import build
+    result = build("/path/to/doc/uberdoc.cfg", pdf=True)
+    if not result.ok:
+        print(result.errors)
+
+Builds don't print, exit or change process wide state like the current
+dir or environment. Any number of them can run concurrently on a thread
+pool, builds of the same document wait for each other.
+"""
+from os import path
+from .config import Config
+from .udoc import Uberdoc, BuildResult, UberdocError
+
+__all__ = ["load_config", "build", "BuildResult", "UberdocError"]
+
+
+def load_config(cfg_file):
+    """Reads a document's uberdoc.cfg, resolving doc_dir relative to the
+    file's dir instead of the current dir
+    """
+    doc_dir = path.dirname(path.abspath(cfg_file))
+    conf = Config(cfg_file)
+    conf["doc_dir"] = path.normpath(path.join(doc_dir, conf.get("doc_dir", ".")))
+    return conf
+
+
+def build(conf, pdf=False, only=None, output=None):
+    """Builds the document described by conf, a Config or the path of an
+    uberdoc.cfg, and returns a BuildResult. output is called with each
+    progress message and an optional color, if given.
+    """
+    if not isinstance(conf, Config):
+        conf = load_config(conf)
+    return Uberdoc(conf, output=output).build(pdf=pdf, only=only)
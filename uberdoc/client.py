@@ -0,0 +1,21 @@
+"""Entry point of the udoc command. Passes the command line to a running
+udoc daemon and only loads uberdoc in process if there is none.
+"""
+import sys
+from . import daemon
+
+# commands which need the terminal or must not run inside the daemon
+LOCAL_ONLY = ("daemon",)
+INTERACTIVE_OPTIONS = ("-d", "--delete")
+
+
+def main():
+    argv = sys.argv[1:]
+    if argv and argv[0] not in LOCAL_ONLY and \
+            not any(opt in argv for opt in INTERACTIVE_OPTIONS):
+        code = daemon.forward(argv)
+        if code is not None:
+            sys.exit(code)
+
+    from .udoc import main as udoc_main
+    udoc_main()
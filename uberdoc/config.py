@@ -34,6 +34,14 @@ class Config:
             raise Exception(
                 "Config file " + self.file_name + " doesn't contain key " + str(key))
 
+    def get(self, key, default=None):
+        """Like [], but returns default for options missing from the config
+        file, e.g. ones added in later uberdoc versions
+        """
+        if self.conf.has_option("MAIN", key):
+            return self.conf.get("MAIN", key)
+        return default
+
     def __setitem__(self, key, value):
         self.conf.set("MAIN", key, value)
 
@@ -0,0 +1,252 @@
+"""Build server for udoc. It keeps one warm Uberdoc instance per document
+dir, so repeated commands skip interpreter startup, imports, config parsing
+and toolchain checks. Clients talk to it over a Unix socket, sending their
+working dir and command line and receiving output and exit code as JSON
+lines. Forwarded commands run with the client's PATH, other environment
+variables are the daemon's.
+
+The socket lives in a dir only its user can access, $XDG_RUNTIME_DIR or a
+private dir below the temp dir. Clients only talk to a socket owned by
+their own user.
+
+Unix sockets are missing on some platforms, e.g. Windows. There the client
+never finds a daemon and runs every command in process.
+
+This module is imported by the thin udoc client, so it must not import
+jinja2 or the udoc module at load time.
+"""
+from __future__ import print_function
+import os
+from os import path
+import sys
+import json
+import socket
+import tempfile
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+# the socket's owner is checked against the user's uid
+AVAILABLE = hasattr(socket, "AF_UNIX") and hasattr(os, "getuid")
+
+# the base class only matters where Daemon can be created
+_Server = socketserver.UnixStreamServer if AVAILABLE else socketserver.BaseServer
+
+
+def _temp_dir():
+    return path.join(tempfile.gettempdir(), "udoc-%d" % os.getuid())
+
+
+def socket_path():
+    """Returns the socket the daemon listens on, UDOC_SOCKET overrides the
+    per user default
+    """
+    if os.environ.get("UDOC_SOCKET"):
+        return os.environ["UDOC_SOCKET"]
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return path.join(os.environ["XDG_RUNTIME_DIR"], "udoc.sock")
+    return path.join(_temp_dir(), "udoc.sock")
+
+
+def _owned(afile):
+    """True if afile exists and belongs to the current user"""
+    try:
+        return os.stat(afile).st_uid == os.getuid()
+    except OSError:
+        return False
+
+
+def _private_dir(adir):
+    """Creates adir accessible by the current user only, or checks that an
+    existing one is. Returns an error message or None.
+    """
+    try:
+        os.mkdir(adir, 0o700)
+    except OSError:
+        if not path.isdir(adir):
+            raise
+    st = os.stat(adir)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        return adir + " must belong to you and be inaccessible to others."
+    return None
+
+
+def forward(argv, cwd=None, sock_file=None):
+    """Runs argv on a running daemon, echoing its output. Returns the exit
+    code, or None if no daemon is listening.
+    """
+    if not AVAILABLE:
+        return None
+    sock_file = sock_file or socket_path()
+    # someone else's socket could fake output and exit code
+    if not _owned(sock_file):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(sock_file)
+    except socket.error:
+        sock.close()
+        return None
+
+    streams = {"out": sys.stdout, "err": sys.stderr}
+    request = {"cwd": path.abspath(cwd or os.getcwd()), "argv": argv,
+               "path": os.environ.get("PATH", "")}
+    stream = sock.makefile("rwb")
+    try:
+        stream.write((json.dumps(request) + "\n").encode("utf-8"))
+        stream.flush()
+        for line in stream:
+            message = json.loads(line.decode("utf-8"))
+            if "exit" in message:
+                return message["exit"]
+            out = streams[message["stream"]]
+            out.write(message["text"])
+            out.flush()
+    finally:
+        stream.close()
+        sock.close()
+    # daemon went away mid command
+    return 1
+
+
+class _Output:
+
+    """File like object sending everything written to it to the client"""
+
+    def __init__(self, stream, name):
+        self.stream = stream
+        self.name = name
+
+    def write(self, text):
+        if not isinstance(text, type(u"")):
+            text = text.decode("utf-8", "replace")
+        message = {"stream": self.name, "text": text}
+        self.stream.write((json.dumps(message) + "\n").encode("utf-8"))
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self):
+        return False
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode("utf-8"))
+        code = self.server.run(request["cwd"], request["argv"],
+                               _Output(self.wfile, "out"),
+                               _Output(self.wfile, "err"),
+                               request.get("path"))
+        self.wfile.write((json.dumps({"exit": code}) + "\n").encode("utf-8"))
+
+
+class Daemon(_Server):
+
+    """Serves udoc commands one at a time, keeping an Uberdoc instance per
+    document dir. An instance is replaced once its uberdoc.cfg changes.
+    """
+
+    def __init__(self, sock_file):
+        self.docs = {}
+        _Server.__init__(self, sock_file, _Handler)
+
+    def uberdoc(self, doc_dir):
+        from .udoc import load
+        cfg_file = path.join(doc_dir, "uberdoc.cfg")
+        cfg_mtime = os.stat(cfg_file).st_mtime if path.isfile(cfg_file) else None
+        if doc_dir not in self.docs or self.docs[doc_dir][0] != cfg_mtime:
+            self.docs[doc_dir] = (cfg_mtime, load())
+        return self.docs[doc_dir][1]
+
+    def run(self, cwd, argv, out, err, search_path=None):
+        """Runs argv in cwd, with the client's PATH if given, so pandoc
+        and the toolchain probe see the same tools as an in process run
+        """
+        from .udoc import run
+        if argv[:1] == ["daemon"]:
+            err.write("udoc daemon is already running.\n")
+            return 1
+
+        old_cwd = os.getcwd()
+        old_out, old_err = sys.stdout, sys.stderr
+        old_path = os.environ.get("PATH")
+        sys.stdout, sys.stderr = out, err
+        try:
+            if search_path is not None:
+                os.environ["PATH"] = search_path
+            os.chdir(cwd)
+            run(self.uberdoc(cwd), argv)
+            return 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+        except Exception as e:
+            print("udoc daemon: " + repr(e), file=sys.stderr)
+            return 1
+        finally:
+            sys.stdout, sys.stderr = old_out, old_err
+            if old_path is None:
+                os.environ.pop("PATH", None)
+            else:
+                os.environ["PATH"] = old_path
+            os.chdir(old_cwd)
+
+
+def _exit_unless_available():
+    if not AVAILABLE:
+        print("udoc daemon needs Unix sockets, which this platform doesn't have.")
+        sys.exit(1)
+
+
+def create(sock_file=None):
+    """Binds a Daemon to the socket, replacing a stale socket file. Exits if
+    another daemon is already listening, the socket or its dir belong to
+    someone else or there are no Unix sockets.
+    """
+    _exit_unless_available()
+    sock_file = sock_file or socket_path()
+    if path.dirname(sock_file) == _temp_dir():
+        error = _private_dir(_temp_dir())
+        if error:
+            print("udoc daemon: " + error)
+            sys.exit(1)
+    if path.exists(sock_file):
+        if not _owned(sock_file):
+            print("udoc daemon: " + sock_file + " belongs to another user.")
+            sys.exit(1)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(sock_file)
+            print("udoc daemon is already running on " + sock_file)
+            sys.exit(1)
+        except socket.error:
+            os.remove(sock_file)
+        finally:
+            probe.close()
+
+    old_umask = os.umask(0o077)
+    try:
+        return Daemon(sock_file)
+    finally:
+        os.umask(old_umask)
+
+
+def serve():
+    """Runs the daemon in the foreground until interrupted"""
+    _exit_unless_available()
+    sock_file = socket_path()
+    server = create(sock_file)
+    print("udoc daemon listening on " + sock_file + " (Ctrl-C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if path.exists(sock_file):
+            os.remove(sock_file)
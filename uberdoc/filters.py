@@ -0,0 +1,304 @@
+"""Chapter filters. A filter gets a chapter's pandoc JSON document and
+returns it changed, e.g. to render diagrams or expand a glossary. Filters
+are listed in the filters setting of uberdoc.cfg and are either
+
+- Python callables, given as module:function or path/to/file.py:function
+  (relative to doc_dir). They are called as function(doc, format,
+  chapter) and return the new document, or None if they changed doc in
+  place. Chapters are filtered on a thread pool, so they must be thread
+  safe.
+- executables following pandoc's JSON filter protocol: the document on
+  stdin, the output format as first argument, the result on stdout. Like
+  under pandoc, they run in the dir pandoc renders in (the copied in_dir)
+  and get PANDOC_VERSION, so e.g. diagram images they write are found.
+  Such files aren't part of the cached results.
+
+Filter results are cached per chapter, keyed on the chapter's path and
+content and the hash of every filter's source or executable.
+
+Since chapters are read one at a time, reference link and footnote
+definitions don't resolve across chapters. merge_docs does redo pandoc's
+de-duplication of header ids.
+"""
+import os
+from os import path
+import io
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import importlib
+import subprocess
+import threading
+from .toolchain import which
+from .publish import atomic_write, file_hash
+
+
+class FilterError(Exception):
+
+    """Raised if a filter can't be loaded or fails"""
+
+
+def _load_module_file(module_file):
+    name = "udoc_filter_" + hashlib.sha1(module_file.encode("utf-8")).hexdigest()[:12]
+    if sys.version_info[0] > 2:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(name, module_file)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    import imp
+    return imp.load_source(name, module_file)
+
+
+try:
+    _reload = importlib.reload
+except AttributeError:
+    from imp import reload as _reload
+
+# source hashes of the imported filter modules, by module name
+_module_hashes = {}
+_import_lock = threading.Lock()
+
+
+def _import_module(module_name):
+    """Imports module_name, reloading it if its source changed since it
+    was imported, e.g. between builds run by the udoc daemon. Returns the
+    module and its source file's hash.
+    """
+    with _import_lock:
+        imported = module_name in sys.modules
+        module = importlib.import_module(module_name)
+        module_file = getattr(module, "__file__", None)
+        if not module_file:
+            # e.g. a namespace package, there's no source to hash for the cache
+            raise FilterError(module_name + " has no source file")
+        if module_file.endswith((".pyc", ".pyo")):
+            module_file = module_file[:-1]
+        source_hash = file_hash(module_file)
+        # a module imported before it was first seen here may be outdated
+        if imported and _module_hashes.get(module_name) != source_hash:
+            module = _reload(module)
+        _module_hashes[module_name] = source_hash
+        return module, source_hash
+
+
+class PythonFilter:
+
+    def __init__(self, spec, base_dir):
+        self.spec = spec
+        module_name, _, func_name = spec.rpartition(":")
+        try:
+            if module_name.endswith(".py"):
+                module_file = path.join(base_dir, module_name)
+                source_hash = file_hash(module_file)
+                module = _load_module_file(module_file)
+            else:
+                module, source_hash = _import_module(module_name)
+            self.func = getattr(module, func_name)
+        except (ImportError, AttributeError, IOError, OSError, FilterError) as e:
+            raise FilterError("Can't load filter " + spec + ": " + str(e))
+        self.hash = spec + ":" + source_hash
+
+    def apply(self, doc, fmt, chapter, cwd=None, pandoc_version=None):
+        try:
+            result = self.func(doc, fmt, chapter)
+        except Exception as e:
+            raise FilterError("Filter %s failed on %s: %r" % (self.spec, chapter, e))
+        return doc if result is None else result
+
+
+class ExecutableFilter:
+
+    def __init__(self, spec, base_dir):
+        self.spec = spec
+        local = path.join(base_dir, spec)
+        self.executable = local if path.isfile(local) else which(spec)
+        if not self.executable:
+            raise FilterError("Can't find filter " + spec)
+        self.hash = spec + ":" + file_hash(self.executable)
+
+    def apply(self, doc, fmt, chapter, cwd=None, pandoc_version=None):
+        env = dict(os.environ)
+        if pandoc_version:
+            env["PANDOC_VERSION"] = pandoc_version
+        process = subprocess.Popen([path.abspath(self.executable), fmt],
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   cwd=cwd,
+                                   env=env)
+        stdout, stderr = process.communicate(json.dumps(doc).encode("utf-8"))
+        if process.returncode != 0:
+            raise FilterError("Filter %s failed on %s: %s" % (
+                self.spec, chapter, stderr.decode("utf-8", "replace").strip()))
+        return json.loads(stdout.decode("utf-8"))
+
+
+def load_filters(specs, base_dir):
+    """Returns a filter for each spec, see the module doc"""
+    filters = []
+    for spec in specs:
+        module_name, sep, func_name = spec.rpartition(":")
+        if sep and module_name and not path.isfile(path.join(base_dir, spec)):
+            filters.append(PythonFilter(spec, base_dir))
+        else:
+            filters.append(ExecutableFilter(spec, base_dir))
+    return filters
+
+
+def cache_key(content, filters, *extra):
+    """Hashes a chapter's content together with the filters and anything
+    else the result depends on, e.g. chapter path, pandoc version and
+    options
+    """
+    sha = hashlib.sha1(content.encode("utf-8"))
+    for part in [f.hash for f in filters] + [str(e) for e in extra]:
+        sha.update(b"\0" + part.encode("utf-8"))
+    return sha.hexdigest()
+
+
+def apply_filters(doc, filters, fmt, chapter, cwd=None, pandoc_version=None):
+    """Runs the filters on doc in order. Executables run in cwd and get
+    pandoc_version, a string like 2.19.2, as PANDOC_VERSION.
+    """
+    for f in filters:
+        doc = f.apply(doc, fmt, chapter, cwd, pandoc_version)
+    return doc
+
+
+class FilterCache:
+
+    """Filtered chapter documents stored as cache_dir/<slot>/<key>.json,
+    with one slot per chapter and output format. A slot only keeps its
+    latest document, and slots unused for max_age days are pruned, so the
+    cache doesn't grow with every edit. Without a cache_dir nothing is
+    cached.
+    """
+
+    def __init__(self, cache_dir, max_age=30):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+
+    def _slot(self, chapter, fmt):
+        slot = hashlib.sha1((chapter + "\0" + fmt).encode("utf-8")).hexdigest()[:16]
+        return path.join(self.cache_dir, slot)
+
+    def get(self, chapter, fmt, key):
+        if not self.cache_dir:
+            return None
+        afile = path.join(self._slot(chapter, fmt), key + ".json")
+        try:
+            with io.open(afile, encoding="utf-8") as f:
+                doc = json.load(f)
+            # keeps the slot from being pruned
+            os.utime(afile, None)
+            return doc
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, chapter, fmt, key, doc):
+        if not self.cache_dir:
+            return
+        slot = self._slot(chapter, fmt)
+        if not path.isdir(slot):
+            try:
+                os.makedirs(slot)
+            except OSError:
+                if not path.isdir(slot):
+                    raise
+        atomic_write(path.join(slot, key + ".json"), json.dumps(doc, ensure_ascii=False))
+        for name in os.listdir(slot):
+            if name != key + ".json" and name.endswith(".json"):
+                _remove(path.join(slot, name))
+
+    def prune(self):
+        """Removes the slots of chapters which weren't built for max_age
+        days, e.g. deleted chapters or formats no longer built
+        """
+        if not self.cache_dir or not path.isdir(self.cache_dir):
+            return
+        oldest = time.time() - self.max_age * 24 * 3600
+        for slot in os.listdir(self.cache_dir):
+            slot = path.join(self.cache_dir, slot)
+            if not path.isdir(slot):
+                continue
+            try:
+                entries = [path.join(slot, name) for name in os.listdir(slot)]
+                stale = all(os.stat(entry).st_mtime < oldest for entry in entries)
+            except OSError:
+                # changed by a concurrent build
+                continue
+            if stale:
+                shutil.rmtree(slot, ignore_errors=True)
+
+
+def _remove(afile):
+    # another build may have replaced it already
+    try:
+        os.remove(afile)
+    except OSError:
+        pass
+
+
+def _headers(node):
+    """Yields the Header elements of a pandoc document part in order"""
+    if isinstance(node, dict):
+        if node.get("t") == "Header":
+            yield node
+        for value in node.values():
+            for header in _headers(value):
+                yield header
+    elif isinstance(node, list):
+        for item in node:
+            for header in _headers(item):
+                yield header
+
+
+def _dedupe_ids(used, blocks):
+    """Gives a chapter's headers pandoc's -1, -2, ... suffixes where their
+    ids are already used by earlier chapters. Suffixes pandoc added within
+    the chapter are recounted from the base id.
+    """
+    headers = list(_headers(blocks))
+    chapter_ids = set(header["c"][1][0] for header in headers)
+    for header in headers:
+        attr = header["c"][1]
+        ident = attr[0]
+        if not ident:
+            continue
+        if ident in used:
+            base = re.match(r"^(.*)-\d+$", ident)
+            if base and base.group(1) in chapter_ids:
+                ident = base.group(1)
+            number = 1
+            while "%s-%d" % (ident, number) in used:
+                number += 1
+            attr[0] = "%s-%d" % (ident, number)
+        used.add(attr[0])
+
+
+def merge_docs(docs):
+    """Combines chapter documents into one, like pandoc does for several
+    input files: blocks are concatenated, the first value of a metadata
+    field wins and duplicate header ids are renamed in place like pandoc
+    renames them within one document
+    """
+    meta = {}
+    blocks = []
+    used = set()
+    for doc in docs:
+        doc_meta, doc_blocks = (doc["meta"], doc["blocks"]) if isinstance(doc, dict) \
+            else (doc[0]["unMeta"], doc[1])
+        for key, value in doc_meta.items():
+            meta.setdefault(key, value)
+        _dedupe_ids(used, doc_blocks)
+        blocks.extend(doc_blocks)
+    if docs and isinstance(docs[0], list):
+        return [{"unMeta": meta}, blocks]
+    merged = {"meta": meta, "blocks": blocks}
+    if docs:
+        merged["pandoc-api-version"] = docs[0]["pandoc-api-version"]
+    return merged
@@ -0,0 +1,210 @@
+"""Index of the headings, anchors, links and images of every chapter, used
+to find broken internal links and image references. The index is stored
+as JSON next to the document and a chapter is only rescanned when its
+file, or a template it includes, changed.
+"""
+import os
+from os import path
+import io
+import re
+import json
+from .publish import atomic_write
+
+_fence = re.compile(r"^\s*(`{3,}|~{3,})")
+_atx_heading = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+_setext_underline = re.compile(r"^\s{0,3}(=+|-+)\s*$")
+_attributes = re.compile(r"\{([^}]*)\}\s*$")
+_explicit_id = re.compile(r"\{[^}]*#([\w:.-]+)[^}]*\}")
+_html_id = re.compile(r"<[^>]*\b(?:id|name)\s*=\s*[\"']([^\"']+)[\"']", re.I)
+_code_span = re.compile(r"(`+).*?\1")
+_inline_link = re.compile(r"(!?)\[(?:[^\]]|\][^(])*?\]\(\s*<?([^)\s>]+)>?(?:\s+[\"'][^)]*)?\)")
+_reference_def = re.compile(r"^\s{0,3}\[[^\]]+\]:\s*<?(\S+?)>?(?:\s|$)")
+_html_link = re.compile(r"<(a|img)\b[^>]*\b(?:href|src)\s*=\s*[\"']([^\"']+)[\"']", re.I)
+_inline_markup = re.compile(r"!?\[([^\]]*)\]\([^)]*\)|\^\[[^\]]*\]|<[^>]+>|[*_`~]")
+
+
+def auto_identifier(text):
+    """Pandoc's identifier for a heading without an explicit one"""
+    text = _inline_markup.sub(lambda m: m.group(1) or "", text)
+    ident = "".join(c for c in text.lower()
+                    if c.isalnum() or c in "_-. \n\t")
+    ident = "-".join(ident.split())
+    while ident and not ident[0].isalpha():
+        ident = ident[1:]
+    return ident or "section"
+
+
+def scan(content):
+    """Returns the headings (explicit id or None, auto id), other anchors
+    and the (target, line, is_image) links of a chapter's markdown
+    """
+    headings = []
+    anchors = []
+    links = []
+    fence = None
+    previous = ""
+    for number, line in enumerate(content.splitlines(), 1):
+        match = _fence.match(line)
+        if fence:
+            if match and match.group(1)[0] == fence[0] and \
+                    len(match.group(1)) >= len(fence):
+                fence = None
+            continue
+        if match:
+            fence = match.group(1)
+            previous = ""
+            continue
+
+        heading = _atx_heading.match(line)
+        if heading:
+            _add_heading(headings, heading.group(2))
+        elif previous.strip() and _setext_underline.match(line) and \
+                not previous.lstrip().startswith(("|", "-", "+", "%", ">")):
+            _add_heading(headings, previous.strip())
+        else:
+            anchors.extend(_explicit_id.findall(line))
+
+        anchors.extend(_html_id.findall(line))
+        text = _code_span.sub("", line)
+        for image, target in _inline_link.findall(text):
+            links.append((target, number, bool(image)))
+        for tag, target in _html_link.findall(text):
+            links.append((target, number, tag.lower() == "img"))
+        definition = _reference_def.match(text)
+        if definition:
+            links.append((definition.group(1), number, False))
+        previous = line
+    return headings, anchors, links
+
+
+def _add_heading(headings, text):
+    attributes = _attributes.search(text)
+    explicit = None
+    if attributes:
+        text = text[:attributes.start()].rstrip()
+        ids = re.findall(r"#([\w:.-]+)", attributes.group(1))
+        explicit = ids[0] if ids else None
+    headings.append((explicit, auto_identifier(text)))
+
+
+def _stamp(base_dir, sources):
+    stamp = []
+    for source in sources:
+        try:
+            st = os.stat(path.join(base_dir, source))
+            stamp.append([source, st.st_mtime, st.st_size])
+        except OSError:
+            stamp.append([source, None, None])
+    return stamp
+
+
+class LinkIndex:
+
+    """Per chapter scan results, persisted in index_file. Entries are
+    stamped with mtime and size of the chapter file and its includes.
+    """
+
+    VERSION = 1
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.chapters = {}
+        self.changed = False
+        try:
+            with io.open(index_file, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self.chapters = data["chapters"]
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    def is_fresh(self, chapter, base_dir):
+        entry = self.chapters.get(chapter)
+        if entry is None:
+            return False
+        sources = [source for source, mtime, size in entry["stamp"]]
+        return _stamp(base_dir, sources) == entry["stamp"]
+
+    def update(self, chapter, content, sources, base_dir):
+        """Scans a chapter's rendered content. sources are the files it
+        was rendered from, relative to base_dir.
+        """
+        headings, anchors, links = scan(content)
+        self.chapters[chapter] = {
+            "stamp": _stamp(base_dir, sources),
+            "headings": headings,
+            "anchors": anchors,
+            "links": links,
+        }
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        atomic_write(self.index_file, json.dumps(
+            {"version": self.VERSION, "chapters": self.chapters}, ensure_ascii=False))
+        self.changed = False
+
+    def anchors(self, chapters):
+        """Returns all ids of the chapters, in document order. Duplicate
+        auto ids get pandoc's -1, -2, ... suffixes
+        """
+        ids = set()
+        for chapter in chapters:
+            entry = self.chapters.get(chapter)
+            if entry is None:
+                continue
+            ids.update(entry["anchors"])
+            ids.update(explicit for explicit, auto in entry["headings"] if explicit)
+        used = {}
+        for chapter in chapters:
+            entry = self.chapters.get(chapter)
+            if entry is None:
+                continue
+            for explicit, auto in entry["headings"]:
+                if explicit:
+                    continue
+                ident = auto
+                while ident in ids:
+                    used[auto] = used.get(auto, 0) + 1
+                    ident = auto + "-" + str(used[auto])
+                ids.add(ident)
+        return ids
+
+    def broken(self, chapters, all_chapters, in_dir):
+        """Returns (chapter, line, target, reason) for every internal link
+        or image reference in chapters which doesn't resolve against the
+        anchors of all_chapters or the files in in_dir
+        """
+        anchors = self.anchors(all_chapters)
+        broken = []
+        for chapter in chapters:
+            entry = self.chapters.get(chapter)
+            if entry is None:
+                continue
+            for target, line, image in entry["links"]:
+                reason = _check_target(target, image, anchors, in_dir)
+                if reason:
+                    broken.append((chapter, line, target, reason))
+        return broken
+
+
+def _check_target(target, image, anchors, in_dir):
+    if re.match(r"^[a-zA-Z][a-zA-Z0-9+.-]*:", target) or target.startswith("//"):
+        return None
+    file_part, _, fragment = target.partition("#")
+    if not file_part:
+        if fragment not in anchors:
+            return "unknown anchor"
+        return None
+    if not image:
+        # links to other output files can't be checked against the index
+        return None
+    afile = path.normpath(path.join(in_dir, file_part.split("?")[0]))
+    if path.isfile(afile):
+        return None
+    if not path.splitext(afile)[1] and path.isdir(path.dirname(afile)):
+        stem = path.basename(afile) + "."
+        if any(name.startswith(stem) for name in os.listdir(path.dirname(afile))):
+            return None
+    return "missing image"
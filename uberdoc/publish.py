@@ -0,0 +1,114 @@
+"""Publishes a freshly built staging dir to the output dir. Only files
+whose content changed are replaced, each by an atomic rename, so unchanged
+files keep their mtime and readers never see a partially written file.
+atomic_write gives the same guarantee to the index and cache files.
+"""
+import os
+from os import path
+import io
+import shutil
+import hashlib
+import errno
+import tempfile
+
+# os.rename doesn't replace existing files on Windows
+_replace = getattr(os, "replace", os.rename)
+
+
+def _temp_file(afile):
+    """Creates a uniquely named temp file next to afile, so concurrent
+    writers of afile never share one. Returns its fd and path.
+    """
+    return tempfile.mkstemp(dir=path.dirname(afile) or ".",
+                            prefix=path.basename(afile) + ".", suffix=".tmp")
+
+
+def atomic_write(afile, text):
+    """Replaces afile with text, encoded as UTF-8. Readers see either the
+    old or the new content.
+    """
+    fd, tmp = _temp_file(afile)
+    try:
+        with io.open(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        _replace(tmp, afile)
+    except BaseException:
+        if path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def file_hash(afile):
+    sha = hashlib.sha1()
+    with open(afile, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def same_content(file1, file2):
+    if not path.isfile(file2):
+        return False
+    if path.getsize(file1) != path.getsize(file2):
+        return False
+    return file_hash(file1) == file_hash(file2)
+
+
+def _move(src, dst):
+    """Moves src over dst atomically, copying to a temp file next to dst
+    first if they are on different file systems
+    """
+    try:
+        _replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        fd, tmp = _temp_file(dst)
+        os.close(fd)
+        shutil.copyfile(src, tmp)
+        shutil.copymode(src, tmp)
+        _replace(tmp, dst)
+
+
+def publish_tree(staging_dir, out_dir, last=(), keep=()):
+    """Moves changed files from staging_dir to out_dir and removes files
+    missing from staging_dir. Files named in last (relative paths) are
+    published after all others, e.g. documents referencing images and
+    styles. Top level entries of out_dir named in keep are left alone.
+    Returns (changed, unchanged, removed) counts.
+    """
+    staged = []
+    for root, dirs, files in os.walk(staging_dir):
+        rel_root = path.relpath(root, staging_dir)
+        for name in files:
+            staged.append(path.normpath(path.join(rel_root, name)))
+    staged.sort(key=lambda rel: (rel in last, rel))
+
+    changed = unchanged = removed = 0
+    for rel in staged:
+        src, dst = path.join(staging_dir, rel), path.join(out_dir, rel)
+        if same_content(src, dst):
+            unchanged += 1
+            continue
+        if path.isdir(dst):
+            shutil.rmtree(dst)
+        if not path.isdir(path.dirname(dst)):
+            os.makedirs(path.dirname(dst))
+        _move(src, dst)
+        changed += 1
+
+    staged = set(staged)
+    for root, dirs, files in os.walk(out_dir, topdown=False):
+        rel_root = path.relpath(root, out_dir)
+        if rel_root == ".":
+            files = [f for f in files if f not in keep]
+        elif rel_root.split(os.sep)[0] in keep:
+            continue
+        for name in files:
+            rel = path.normpath(path.join(rel_root, name))
+            if rel not in staged:
+                os.remove(path.join(root, name))
+                removed += 1
+        if rel_root != "." and not os.listdir(root):
+            os.rmdir(root)
+    return changed, unchanged, removed
@@ -0,0 +1,187 @@
+"""Build metrics. Every build collects phase durations, sizes and cache
+counters in a Metrics object, which is appended to a small SQLite
+database next to the document, so `udoc stats` can show trends and
+regressions over time.
+"""
+import time
+import threading
+import datetime
+import sqlite3
+from contextlib import contextmanager
+
+timer = getattr(time, "perf_counter", time.time)
+
+SCHEMA = """
+create table if not exists builds (
+    id integer primary key autoincrement,
+    started text not null,
+    kind text not null,
+    version text
+);
+create table if not exists measures (
+    build_id integer not null references builds(id),
+    name text not null,
+    value real not null
+);
+create index if not exists measures_build on measures(build_id);
+"""
+
+
+class Metrics:
+
+    """Collects the measurements of a single build. Names are dotted, e.g.
+    phase.preprocess, bytes.rendered or cache.version.hit. Adding is thread
+    safe, builds render formats and filter chapters on thread pools.
+    """
+
+    def __init__(self):
+        self.started = datetime.datetime.now()
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, amount=1):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + amount
+
+    def count_cache(self, cache, hit):
+        self.add("cache." + cache + (".hit" if hit else ".miss"))
+
+    @contextmanager
+    def phase(self, name):
+        """Adds the time spent in the with block to phase.<name>"""
+        start = timer()
+        try:
+            yield
+        finally:
+            self.add("phase." + name, timer() - start)
+
+
+def _connect(db_file):
+    db = sqlite3.connect(db_file)
+    db.executescript(SCHEMA)
+    return db
+
+
+def record(db_file, metrics, kind, version=None):
+    """Appends the metrics of a finished build to db_file"""
+    db = _connect(db_file)
+    try:
+        with db:
+            cursor = db.execute(
+                "insert into builds (started, kind, version) values (?, ?, ?)",
+                (metrics.started.strftime("%Y-%m-%d %H:%M:%S"), kind, version))
+            db.executemany(
+                "insert into measures (build_id, name, value) values (?, ?, ?)",
+                [(cursor.lastrowid, name, value)
+                 for name, value in sorted(metrics.values.items())])
+    finally:
+        db.close()
+
+
+def history(db_file, limit, kind="full"):
+    """Returns the last limit builds of a kind, oldest first, as
+    (started, version, {name: value}) tuples
+    """
+    db = _connect(db_file)
+    try:
+        builds = db.execute(
+            "select id, started, version from builds where kind = ? "
+            "order by id desc limit ?", (kind, limit)).fetchall()
+        result = []
+        for build_id, started, version in reversed(builds):
+            values = dict(db.execute(
+                "select name, value from measures where build_id = ?",
+                (build_id,)).fetchall())
+            result.append((started, version, values))
+        return result
+    finally:
+        db.close()
+
+
+def percentile(values, p):
+    """Nearest rank percentile of a non empty list"""
+    ordered = sorted(values)
+    rank = int(round(p / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+def regressions(builds, recent, threshold=1.2, min_delta=0.05):
+    """Compares the median of every phase over the last recent builds with
+    the median over the builds before them. Returns
+    (name, baseline, current) for phases slower by more than threshold.
+    """
+    current, baseline = builds[-recent:], builds[:-recent]
+    if not baseline:
+        return []
+    names = set()
+    for started, version, values in builds:
+        names.update(name for name in values if name.startswith("phase."))
+    slower = []
+    for name in sorted(names) + ["total"]:
+        before = [values[name] for _, _, values in baseline if name in values]
+        after = [values[name] for _, _, values in current if name in values]
+        if not before or not after:
+            continue
+        before, after = percentile(before, 50), percentile(after, 50)
+        if after > before * threshold and after - before > min_delta:
+            slower.append((name, before, after))
+    return slower
+
+
+def _size(num):
+    for unit in ("B", "KB", "MB"):
+        if abs(num) < 1024:
+            return "%.0f%s" % (num, unit)
+        num /= 1024.0
+    return "%.1fGB" % num
+
+
+def report(db_file, echo, last=10, baseline=20, recent=5, kind="full"):
+    """Passes recent builds, percentiles of their phase durations and the
+    phases which got slower compared to the builds before to echo, which
+    takes a message and an optional color like Uberdoc.echo
+    """
+    builds = history(db_file, baseline + recent, kind)
+    if not builds:
+        echo("No " + kind + " builds recorded yet.")
+        return
+
+    echo("Last builds:", "yellow")
+    echo("  %-19s %8s %8s %9s %9s  %s" % (
+        "started", "total", "chapters", "rendered", "output", "version"))
+    for started, version, values in builds[-last:]:
+        output = sum(v for name, v in values.items() if name.startswith("output."))
+        echo("  %-19s %7.2fs %8d %9s %9s  %s" % (
+            started, values.get("total", 0), values.get("chapters", 0),
+            _size(values.get("bytes.rendered", 0)), _size(output), version or ""))
+
+    echo("Phase durations over " + str(len(builds)) + " builds:", "yellow")
+    echo("  %-22s %8s %8s %8s" % ("phase", "p50", "p90", "max"))
+    names = sorted(set(name for _, _, values in builds for name in values
+                       if name.startswith("phase.")))
+    for name in names + ["total"]:
+        durations = [values[name] for _, _, values in builds if name in values]
+        echo("  %-22s %7.2fs %7.2fs %7.2fs" % (
+            name, percentile(durations, 50), percentile(durations, 90),
+            max(durations)))
+
+    caches = sorted(set(name[:-len(".hit")] for _, _, values in builds
+                        for name in values if name.endswith(".hit")))
+    if caches:
+        echo("Cache hit rates:", "yellow")
+        for cache in caches:
+            hits = sum(values.get(cache + ".hit", 0) for _, _, values in builds)
+            misses = sum(values.get(cache + ".miss", 0) for _, _, values in builds)
+            echo("  %-22s %7.0f%%" % (cache, 100.0 * hits / max(hits + misses, 1)))
+
+    slower = regressions(builds, recent)
+    if len(builds) <= recent:
+        echo("Not enough builds yet to compare against a baseline.")
+    elif slower:
+        echo("Slower than baseline (median of last " + str(recent) +
+               " vs. " + str(len(builds) - recent) + " builds before):", "red")
+        for name, before, after in slower:
+            echo("  %-22s %7.2fs -> %.2fs (+%.0f%%)" % (
+                name, before, after, 100.0 * (after - before) / before))
+    else:
+        echo("No phase regressed compared to the baseline.", "green")
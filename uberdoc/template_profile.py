@@ -0,0 +1,108 @@
+"""Profiler for the Jinja preprocessing step. It records calls, cumulative
+render time and output size per chapter, per rendered template (the
+chapter's own and every included one) and per macro, so slow templating
+constructs can be found without guessing.
+
+Times are inclusive: an include's time is also part of the template
+including it. Loops are not measured on their own, their cost shows up
+in the template or macro containing them.
+"""
+from __future__ import print_function
+from jinja2 import Environment, Template
+from jinja2.runtime import Macro
+from .stats import timer
+
+
+class TemplateProfiler:
+
+    """Collects (calls, seconds, bytes) per (kind, name), kind being one
+    of chapter, template or macro
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def add(self, kind, name, seconds, size):
+        entry = self.entries.setdefault((kind, name), [0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += size
+
+    def environment(self, loader):
+        """Returns a Jinja environment whose templates report here"""
+        env = Environment(loader=loader)
+        env.template_class = _profiling_template_class(self)
+        return env
+
+    def hottest(self, kind=None, limit=20):
+        """Returns (kind, name, calls, seconds, bytes) sorted by time"""
+        rows = [(k, name, calls, seconds, size)
+                for (k, name), (calls, seconds, size) in self.entries.items()
+                if kind is None or k == kind]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows[:limit]
+
+    def report(self, echo, limit=20):
+        """Passes the hottest entries of each kind to echo, which takes a
+        message and an optional color like Uberdoc.echo
+        """
+        for kind, title in (("chapter", "Chapters"),
+                            ("template", "Templates and includes"),
+                            ("macro", "Macros")):
+            rows = self.hottest(kind, limit)
+            if not rows:
+                continue
+            echo(title + " by cumulative render time:", "yellow")
+            echo("  %9s %7s %10s  %s" % ("time", "calls", "output", "name"))
+            for kind, name, calls, seconds, size in rows:
+                echo("  %8.3fs %7d %9dB  %s" % (seconds, calls, size, name))
+
+
+def _profiling_template_class(profiler):
+
+    class ProfilingTemplate(Template):
+
+        @classmethod
+        def _from_namespace(cls, environment, namespace, globals):
+            template = super(ProfilingTemplate, cls)._from_namespace(
+                environment, namespace, globals)
+            name = namespace["name"]
+            # compiled templates look up Macro in their module namespace
+            namespace["Macro"] = _profiling_macro_class(profiler, name)
+            render = template.root_render_func
+
+            def root_render_func(context):
+                seconds, size = 0.0, 0
+                events = render(context)
+                try:
+                    while True:
+                        start = timer()
+                        try:
+                            event = next(events)
+                        finally:
+                            seconds += timer() - start
+                        size += len(event)
+                        yield event
+                except StopIteration:
+                    pass
+                finally:
+                    profiler.add("template", name, seconds, size)
+
+            template.root_render_func = root_render_func
+            return template
+
+    return ProfilingTemplate
+
+
+def _profiling_macro_class(profiler, template_name):
+
+    class ProfilingMacro(Macro):
+
+        def __call__(self, *args, **kwargs):
+            start = timer()
+            rv = Macro.__call__(self, *args, **kwargs)
+            profiler.add("macro", "%s: %s()" % (template_name, self.name),
+                         timer() - start, len(rv))
+            return rv
+
+    return ProfilingMacro
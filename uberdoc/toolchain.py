@@ -0,0 +1,144 @@
+"""Probes the external tools a build needs: pandoc, git and the LaTeX
+engine. Their paths, versions and pandoc's supported formats and options
+are cached in a JSON file, keyed on PATH and the mtimes of the found
+executables, so repeated builds don't spawn the tools just to ask them.
+"""
+import os
+from os import path
+import io
+import re
+import json
+import hashlib
+import shutil
+import subprocess
+from .publish import atomic_write
+
+try:
+    _which = shutil.which
+except AttributeError:
+    from distutils.spawn import find_executable as _which
+
+CACHE_VERSION = 1
+
+
+def which(cmd):
+    """Returns the full path of cmd found in PATH, or None"""
+    return _which(cmd)
+
+
+def cache_key(tools):
+    """Hashes PATH and the path and mtime of each tool's executable.
+    tools maps a tool name (pandoc, git, latex) to its command.
+    """
+    found = []
+    for name, cmd in sorted(tools.items()):
+        exe = which(cmd)
+        mtime = os.stat(exe).st_mtime if exe else None
+        found.append([name, cmd, exe, mtime])
+    key = json.dumps([CACHE_VERSION, os.environ.get("PATH", ""), found])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _output(args):
+    """Returns the stdout of running args, or None if that failed"""
+    try:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+    except OSError:
+        return None
+    if process.returncode != 0:
+        return None
+    return stdout.decode("utf-8", "replace")
+
+
+def _version(text):
+    if not text:
+        return None
+    match = re.search(r"(\d+(?:\.\d+)+)", text.splitlines()[0])
+    return match.group(1) if match else None
+
+
+def _probe_tool(cmd, version_arg="--version"):
+    exe = which(cmd)
+    info = {"command": cmd, "path": exe, "version": None}
+    if exe:
+        info["version"] = _version(_output([exe, version_arg]))
+    return info
+
+
+def _probe_pandoc(cmd):
+    info = _probe_tool(cmd)
+    info["input_formats"] = []
+    info["output_formats"] = []
+    info["options"] = []
+    if info["path"]:
+        for key, arg in (("input_formats", "--list-input-formats"),
+                         ("output_formats", "--list-output-formats")):
+            listing = _output([info["path"], arg])
+            if listing:
+                info[key] = listing.split()
+        help_text = _output([info["path"], "--help"]) or ""
+        info["options"] = sorted(set(re.findall(r"(--[a-z][a-z0-9-]*)", help_text)))
+    return info
+
+
+class Toolchain:
+
+    """Probe results. tools maps pandoc, git and latex to dicts with the
+    command, path (None if not found) and version, pandoc's also lists
+    input_formats, output_formats and options
+    """
+
+    def __init__(self, tools, key=None, cached=False):
+        self.tools = tools
+        self.key = key
+        self.cached = cached
+
+    def __getitem__(self, name):
+        return self.tools[name]
+
+    def path(self, name):
+        return self.tools[name]["path"]
+
+    def version(self, name):
+        """Returns the version as tuple of ints, empty if unknown"""
+        version = self.tools[name]["version"]
+        return tuple(int(part) for part in version.split(".")) if version else ()
+
+    def supports_output(self, fmt):
+        """True if pandoc can write fmt, or its formats couldn't be listed"""
+        formats = self.tools["pandoc"]["output_formats"]
+        return not formats or fmt in formats or fmt in ("pdf", "html")
+
+    def supports_option(self, option):
+        """True if pandoc knows option, or its options couldn't be listed"""
+        options = self.tools["pandoc"]["options"]
+        return not options or option in options
+
+
+def probe(tools, cache_file=None, key=None):
+    """Returns the Toolchain for tools, reading it from cache_file when the
+    key still matches and probing the tools otherwise
+    """
+    key = key or cache_key(tools)
+    if cache_file and path.isfile(cache_file):
+        try:
+            with io.open(cache_file, encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("key") == key:
+                return Toolchain(cached["tools"], key, cached=True)
+        except (IOError, OSError, ValueError):
+            pass
+
+    probed = {}
+    for name, cmd in tools.items():
+        if name == "pandoc":
+            probed[name] = _probe_pandoc(cmd)
+        else:
+            probed[name] = _probe_tool(cmd)
+
+    if cache_file:
+        atomic_write(cache_file, json.dumps({"key": key, "tools": probed},
+                                            ensure_ascii=False))
+    return Toolchain(probed, key)
@@ -12,18 +12,51 @@ import sys
 import subprocess
 import shlex
 import shutil
-import distutils.spawn
 import pkg_resources
 import datetime
+import fnmatch
+import io
+import re
+import json
+import uuid
+import threading
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from pkg_resources import resource_filename
-from jinja2 import Template, Environment, FileSystemLoader
+from jinja2 import Template, Environment, FileSystemLoader, meta
 from .config import Config
+from .stats import Metrics
+from .publish import publish_tree
+from .links import LinkIndex
+from .template_profile import TemplateProfiler
+from . import toolchain
+from . import filters
+from . import stats
 
 if sys.version_info[0] > 2:
     from .termcolor import colored, cprint
 else:
     from termcolor import colored, cprint
 
+try:
+    input = raw_input
+except NameError:
+    pass
+
+# used for output formats without a pandoc_options_<format> setting
+DEFAULT_PANDOC_OPTIONS = {
+    "html": "-s --default-image-extension=png",
+    "pdf": "-s --default-image-extension=pdf --toc --number-sections",
+    "epub": "-s --default-image-extension=png --toc",
+    "docx": "-s --default-image-extension=png --toc",
+}
+
+# templates (looked up in doc_dir/templates, then uberdoc's own) per format
+FORMAT_TEMPLATES = {
+    "html": "default.html",
+    "pdf": "default.tex",
+}
+
 __author__ = "Stephan Brosinski"
 __version__ = "1.2.2"
 
@@ -33,33 +66,193 @@ __version__ = "1.2.2"
 # - "View Source" Feature in HTML, see the Markup?
 # - "Jump direkectly to markdown File from HTML" - Feature?
 
+def _subdirs(adir):
+    """Lists the names of adir's sub dirs, using a single scandir pass
+    where available
+    """
+    if hasattr(os, "scandir"):
+        return [entry.name for entry in os.scandir(adir) if entry.is_dir()]
+    return [name for name in os.listdir(adir)
+            if path.isdir(path.join(adir, name))]
+
+
+def _option_value(options, name):
+    """Returns the value of a --name=value or --name value option"""
+    args = shlex.split(options)
+    for i, arg in enumerate(args):
+        if arg.startswith(name + "="):
+            return arg[len(name) + 1:]
+        if arg == name and i + 1 < len(args):
+            return args[i + 1]
+    return None
+
+
+_reader_option = re.compile(r"(?<!\S)(?:--from|--read|-f|-r)(?:=|\s+)?\S+")
+
+
+def _strip_reader_options(options):
+    """Removes -f/--from options, returning the rest and the removed ones"""
+    removed = [m.strip() for m in _reader_option.findall(options)]
+    return _reader_option.sub("", options), removed
+
+
+def _set_image_extension(node, ext):
+    """Adds ext to all image targets without extension in a pandoc AST"""
+    if isinstance(node, dict):
+        if node.get("t") == "Image":
+            target = node["c"][-1]
+            if not path.splitext(target[0])[1]:
+                target[0] += "." + ext
+        for value in node.values():
+            _set_image_extension(value, ext)
+    elif isinstance(node, list):
+        for item in node:
+            _set_image_extension(item, ext)
+
+
+class UberdocError(Exception):
+
+    """Raised for problems which stop a command, e.g. a missing toc file"""
+
+
+class BuildResult:
+
+    """Outcome of a build: paths of the generated documents, phase timings
+    in seconds, all collected metrics and the warnings and errors reported
+    along the way
+    """
+
+    def __init__(self, outputs, metrics, warnings, errors):
+        self.outputs = outputs
+        self.metrics = dict(metrics.values)
+        self.timings = dict((name[len("phase."):], value)
+                            for name, value in metrics.values.items()
+                            if name.startswith("phase."))
+        self.timings["total"] = metrics.values.get("total", 0)
+        self.warnings = warnings
+        self.errors = errors
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def print_output(msg, color=None):
+    """Default output of Uberdoc instances, writes to stdout"""
+    if color:
+        cprint(msg, color)
+    else:
+        print(msg)
+
+
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+
+
+def _build_lock(staging_dir):
+    """Returns the lock serializing builds into the same staging dir"""
+    with _build_locks_lock:
+        return _build_locks.setdefault(path.abspath(staging_dir), threading.Lock())
+
+
 class Uberdoc:
 
-    def __init__(self, conf):
+    """Build environment for one document. Progress goes to output, a
+    callable taking a message and an optional color, or nowhere if it's
+    None. An instance runs one build at a time, further calls wait for it.
+    Separate instances can build concurrently.
+    """
+
+    def __init__(self, conf, output=print_output):
         self.conf = conf
+        self.output = output
         self.out_dir = self.prefix_path(self.conf["out_dir"])
         self.in_dir = self.prefix_path(self.conf["in_dir"])
         self.style_dir = self.prefix_path(self.conf["style_dir"])
         self.template_dir = self.prefix_path("templates")
+        self.doc_filename = self.conf["doc_filename"]
+        self.staging_dir = self.prefix_path(".udoc_staging", "full")
+        self._toolchain = None
+        self._version = None
+        self._template_env = None
+        self._draft = None
+        self._staging = None
+        self._link_index = None
+        self.metrics = Metrics()
+        self.warnings = []
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def echo(self, msg, color=None):
+        if self.output is not None:
+            self.output(msg, color)
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+        self.echo(msg, "yellow")
+
+    def _share_build_state(self, other):
+        """Makes other report into this instance's metrics and messages"""
+        other.output = self.output
+        other.metrics = self.metrics
+        other.warnings = self.warnings
+        other.errors = self.errors
+
+    def draft(self):
+        """Returns an Uberdoc instance which builds into its own dir below
+        out_dir and names its output differently, so a draft build never
+        touches the full document
+        """
+        if self._draft is None:
+            self._draft = Uberdoc(self.conf)
+            self._draft.out_dir = path.join(self.out_dir, "draft")
+            self._draft.doc_filename = self.doc_filename + "-draft"
+            self._draft.staging_dir = self.prefix_path(".udoc_staging", "draft")
+        self._share_build_state(self._draft)
+        return self._draft
+
+    def staging(self):
+        """Returns an Uberdoc instance which builds into staging_dir. Its
+        output is then published to out_dir.
+        """
+        if self._staging is None:
+            self._staging = Uberdoc(self.conf)
+            self._staging.out_dir = self.staging_dir
+            self._staging.doc_filename = self.doc_filename
+            self._staging.staging_dir = None
+        self._share_build_state(self._staging)
+        return self._staging
+
+    def publish(self, staging_dir, keep=()):
+        """Replaces the changed files in out_dir with the ones built in
+        staging_dir and removes stale ones. Generated documents go last.
+        """
+        last = [self.doc_filename + "." + fmt for fmt in self.output_formats(pdf=True)]
+        changed, unchanged, removed = publish_tree(
+            staging_dir, self.out_dir, last=last, keep=keep)
+        self.metrics.add("publish.changed", changed)
+        self.metrics.add("publish.unchanged", unchanged)
+        self.metrics.add("publish.removed", removed)
+        self.echo("Published %d changed files, %d unchanged, %d removed" %
+              (changed, unchanged, removed))
 
     def cmd(self, cmdStr, verbose=False, cwd='.', echo=False, env=[]):
         """Executes cmdStr as shell command in the working directory provided
-        by cwd
+        by cwd. env is a list of (name, value) pairs added to a copy of the
+        process environment.
         """
 
         if echo:
-            print(cmdStr)
+            self.echo(cmdStr)
 
-        for key, value in env:
-            os.environ[key] = value
-
-        cmd_env = os.environ
+        cmd_env = dict(os.environ)
+        cmd_env.update(env)
 
         if verbose:
-            print('-------- executing cmd -------------')
-            print('cmd: ' + cmdStr + '\n')
-            print('cwd: ' + cwd + '\n')
-            print('env: ' + str(cmd_env) + '\n')
+            self.echo('-------- executing cmd -------------')
+            self.echo('cmd: ' + cmdStr + '\n')
+            self.echo('cwd: ' + cwd + '\n')
+            self.echo('env: ' + str(cmd_env) + '\n')
 
         process = subprocess.Popen(shlex.split(cmdStr),
                                    stdout=subprocess.PIPE,
@@ -70,113 +263,379 @@ class Uberdoc:
         (stdout, stderr) = process.communicate()
 
         if verbose and stdout:
-            print('out: ' + stdout)
+            self.echo('out: ' + stdout.decode('utf-8', 'replace'))
 
         if process.returncode > 0:
-            cprint(stderr, "red")
+            self.echo(stderr.decode('utf-8', 'replace'), "red")
 
         if verbose:
-            print('-------- done executing cmd --------')
+            self.echo('-------- done executing cmd --------')
 
         return (process.returncode, stdout.decode('utf-8'), stderr.decode('utf-8'))
 
     def generate_file_list(self, toc_lines):
         """Uses the toc to generate chapter relative paths to the input files"""
-        files = []
-        for line in toc_lines:
-            files.append(path.join(line, line + self.conf["input_ext"]))
-        return files
+        return [self.chapter_file(line) for line in toc_lines]
 
-    def preprocess(self, files):
+    def chapter_file(self, toc_entry):
+        """Returns the in_dir relative path of a toc entry's chapter file"""
+        return toc_entry + "/" + path.basename(toc_entry) + self.conf["input_ext"]
+
+    def template_env(self):
+        """Returns the Jinja environment for the copied input files. It is
+        kept around, so a long lived instance (see udoc daemon) reuses
+        compiled templates whose sources didn't change
+        """
         template_dir = os.path.join(self.out_dir, self.conf["in_dir"])
-        env = Environment(loader=FileSystemLoader(template_dir))
+        reuse = self._template_env is not None and \
+            self._template_env.loader.searchpath == [template_dir]
+        self.metrics.count_cache("template_env", reuse)
+        if not reuse:
+            self._template_env = Environment(
+                loader=FileSystemLoader(template_dir))
+        return self._template_env
+
+    def template_vars(self, input_file, doc_version, tools):
+        return {
+            "udoc": {
+                "version": __version__,
+                "doc_version": doc_version,
+                "md_file": input_file,
+                "toolchain": tools
+            },
+            "conf": self.conf.user_items()
+        }
+
+    def preprocess(self, files):
+        env = self.template_env()
         doc_version = self.version()
-        user_conf_items = self.conf.user_items()
+        tools = self.toolchain().tools
 
         for input_file in files:
-            print("Preprocessing " + input_file)
-
-            template_vars = {
-                "udoc": {
-                    "version": __version__,
-                    "doc_version": doc_version,
-                    "md_file": input_file
-                },
-                "conf": user_conf_items
-            }
+            self.echo("Preprocessing " + input_file)
 
             template = env.get_template(input_file)
-            content = template.render(template_vars)
+            content = template.render(self.template_vars(input_file, doc_version, tools))
             complete_input_file = os.path.join(self.out_dir, self.conf["in_dir"], input_file)
 
-            with open(complete_input_file, 'w') as fout:
-                content_enc = content.encode('utf-8')
-                fout.write(content_enc)
-
+            with io.open(complete_input_file, 'w', encoding='utf-8') as fout:
+                fout.write(content)
+            self.metrics.add("bytes.rendered", len(content.encode('utf-8')))
+            self.index_links(input_file, content)
+        self.link_index().save()
 
+    def profile_templates(self, only=None, limit=20):
+        """Renders the toc's chapters, or those matching only, with a
+        TemplateProfiler and reports the slowest chapters, templates and
+        macros. Nothing is written.
+        """
+        toc = self.read_toc()
+        if only:
+            toc = self.select_chapters(toc, only)
+        profiler = TemplateProfiler()
+        env = profiler.environment(FileSystemLoader(self.in_dir))
+        doc_version = self.version()
+        tools = self.toolchain().tools
+        for input_file in self.generate_file_list(toc):
+            start = stats.timer()
+            template = env.get_template(input_file)
+            content = template.render(self.template_vars(input_file, doc_version, tools))
+            profiler.add("chapter", input_file, stats.timer() - start, len(content))
+        profiler.report(self.echo, limit)
+        return profiler
+
+    def link_index(self):
+        """Returns the document's index of headings, anchors and links"""
+        if self._link_index is None:
+            self._link_index = LinkIndex(
+                self.prefix_path(self.conf.get("link_index_file", ".udoc_links.json")))
+        return self._link_index
+
+    def index_links(self, input_file, content):
+        """Rescans a rendered chapter for the link index, unless neither it
+        nor its includes changed since the last scan
+        """
+        index = self.link_index()
+        fresh = index.is_fresh(input_file, self.in_dir)
+        self.metrics.count_cache("link_index", fresh)
+        if not fresh:
+            index.update(input_file, content,
+                         self.referenced_sources([input_file]), self.in_dir)
+
+    def check_links(self):
+        """Returns (chapter, line, target, reason) for each broken internal
+        link or image reference in the toc's chapters. Only chapters which
+        changed since they were last indexed get rendered and scanned.
+        """
+        files = self.generate_file_list(self.read_toc())
+        self.index_chapters(files)
+        return self.link_index().broken(files, files, self.in_dir)
 
-    def generate_doc(self, files, pdf=False, verbose=False):
-        """Calls pandoc to generate html, and optionally PDF docs"""
+    def index_chapters(self, files):
+        """Renders and indexes those of the given chapters which changed
+        since they were last indexed
+        """
+        index = self.link_index()
+        env = Environment(loader=FileSystemLoader(self.in_dir))
+        doc_version = tools = None
+        for input_file in files:
+            if index.is_fresh(input_file, self.in_dir):
+                continue
+            if doc_version is None:
+                doc_version = self.version()
+                tools = self.toolchain().tools
+            template = env.get_template(input_file)
+            content = template.render(self.template_vars(input_file, doc_version, tools))
+            index.update(input_file, content,
+                         self.referenced_sources([input_file]), self.in_dir)
+        index.save()
+
+    def output_formats(self, pdf=False):
+        """Returns the formats listed in the formats setting, plus pdf if
+        requested
+        """
+        formats = self.conf.get("formats", "html").replace(",", " ").split()
+        if pdf and "pdf" not in formats:
+            formats.append("pdf")
+        if not formats:
+            raise UberdocError("Error: No output formats, check the formats setting.")
+        return formats
+
+    def generate_doc(self, files, pdf=False, verbose=False, formats=None):
+        """Calls pandoc to parse the input files once into its JSON
+        representation, then renders every output format (html and
+        optionally pdf by default) from it in parallel. With filters, each
+        format is rendered from its own filtered document.
+        """
+        if formats is None:
+            formats = self.output_formats(pdf)
         file_list = " ".join(files)
 
-        out_file = path.join(path.abspath(self.out_dir), self.conf["doc_filename"])
+        out_file = path.join(path.abspath(self.out_dir), self.doc_filename)
+        pandoc_wd = path.join(self.out_dir, self.conf["in_dir"])
 
-        html_template = path.abspath(
-            path.join(self.conf["doc_dir"], "templates", "default.html"))
-        if path.isfile(html_template):
-            template = ' --template=' + html_template
+        filter_specs = self.conf.get("filters", "").replace(",", " ").split()
+        if filter_specs:
+            with self.metrics.phase("filters"):
+                sources = self._filter_chapters(files, filter_specs, formats,
+                                                out_file, verbose)
         else:
-            template = ' --template=' + \
-                resource_filename(__name__, "templates/default.html")
+            parse_cmd = " ".join([
+                self.conf["pandoc_cmd"],
+                self.conf.get("pandoc_options_read", "-f markdown"),
+                "-t json",
+                file_list,
+                "-o",
+                out_file + ".json"])
+            with self.metrics.phase("pandoc_parse"):
+                returncode, out, error = self.cmd(
+                    parse_cmd, cwd=pandoc_wd, verbose=verbose)
+            if returncode > 0 or not path.isfile(out_file + ".json"):
+                raise UberdocError("Error: pandoc couldn't read the input files.")
+            sources = dict((fmt, out_file + ".json") for fmt in formats)
 
-        pandoc_wd = path.join(self.out_dir, self.conf["in_dir"])
+        doc_version = self.version()
+        # pandoc and TeX take their timestamps from here, which keeps the
+        # output identical for unchanged input
+        env = [("SOURCE_DATE_EPOCH", str(self.source_date_epoch())),
+               ("FORCE_SOURCE_DATE", "1")]
+        pool = ThreadPool(len(formats))
+        try:
+            pool.map(lambda fmt: self._render(out_file, fmt, sources[fmt],
+                                              doc_version, verbose, env),
+                     formats)
+        finally:
+            pool.close()
+        for source in set(sources.values()):
+            os.remove(source)
+
+    def _filter_chapters(self, files, filter_specs, formats, out_file, verbose=False):
+        """Parses each chapter separately, runs the configured filters on it
+        for every output format and merges the results into one document
+        per format. Chapters are handled in parallel and each chapter's
+        filtered document is cached per format. Returns the merged
+        documents' files by format.
+        """
+        try:
+            chapter_filters = filters.load_filters(
+                filter_specs, path.abspath(self.conf["doc_dir"]))
+        except filters.FilterError as e:
+            raise UberdocError("Error: " + str(e))
+        cache_dir = self.conf.get("filter_cache_dir", path.join(".udoc_cache", "filters"))
+        cache = filters.FilterCache(self.prefix_path(cache_dir) if cache_dir else None)
+        read_options = self.conf.get("pandoc_options_read", "-f markdown")
+        pandoc_version = self.toolchain()["pandoc"]["version"]
+        # executable filters run where pandoc renders, like under pandoc
+        pandoc_wd = path.abspath(path.join(self.out_dir, self.conf["in_dir"]))
+
+        def filter_chapter(input_file):
+            with io.open(path.join(self.out_dir, self.conf["in_dir"], input_file),
+                         encoding="utf-8") as f:
+                content = f.read()
+            parsed = None
+            docs = []
+            for fmt in formats:
+                # filters get the chapter's path, their output may depend on it
+                key = filters.cache_key(content, chapter_filters, input_file, fmt,
+                                        pandoc_version, read_options)
+                doc = cache.get(input_file, fmt, key)
+                self.metrics.count_cache("filters", doc is not None)
+                if doc is None:
+                    if parsed is None:
+                        returncode, parsed, error = self.cmd(
+                            " ".join([self.conf["pandoc_cmd"], read_options,
+                                      "-t json", input_file]),
+                            cwd=pandoc_wd, verbose=verbose)
+                        if returncode > 0:
+                            raise UberdocError("Error: pandoc couldn't read " + input_file)
+                    doc = filters.apply_filters(json.loads(parsed), chapter_filters,
+                                                fmt, input_file, pandoc_wd, pandoc_version)
+                    cache.put(input_file, fmt, key, doc)
+                docs.append(doc)
+            return docs
+
+        pool = ThreadPool(max(1, min(len(files), cpu_count() * 2)))
+        try:
+            chapter_docs = pool.map(filter_chapter, files)
+        except filters.FilterError as e:
+            raise UberdocError("Error: " + str(e))
+        finally:
+            pool.close()
+        cache.prune()
+
+        sources = {}
+        for i, fmt in enumerate(formats):
+            sources[fmt] = out_file + "." + fmt + ".filtered.json"
+            with io.open(sources[fmt], "w", encoding="utf-8") as f:
+                f.write(json.dumps(filters.merge_docs([docs[i] for docs in chapter_docs]),
+                                   ensure_ascii=False))
+        return sources
+
+    def _render(self, out_file, fmt, source, doc_version, verbose=False, env=[]):
+        """Renders the JSON document source into out_file.fmt. Like
+        reading, writing runs in the copied in_dir, so relative paths in
+        the options and image paths resolve as before.
+        """
+        options, reader_options = _strip_reader_options(self.conf.get(
+            "pandoc_options_" + fmt, DEFAULT_PANDOC_OPTIONS.get(fmt, "-s")))
+        if reader_options:
+            self.warn("Ignoring %s in pandoc_options_%s, the input is read "
+                      "with pandoc_options_read." % (" ".join(reader_options), fmt))
+        template = ""
+        if fmt in FORMAT_TEMPLATES:
+            template = ' --template=' + self._template(FORMAT_TEMPLATES[fmt])
+        if fmt == "epub" and "identifier=" not in options:
+            # pandoc makes up a random one otherwise
+            options += " -M identifier=urn:uuid:" + str(
+                uuid.uuid5(uuid.NAMESPACE_URL, "uberdoc:" + self.conf["doc_filename"]))
+
+        # the default image extension is a reader option, since the json
+        # was read once for all formats it's applied here instead
+        json_file = source
+        image_ext = _option_value(options, "--default-image-extension")
+        if image_ext:
+            json_file = out_file + "." + fmt + ".json"
+            with io.open(source, encoding="utf-8") as f:
+                ast = json.load(f)
+            _set_image_extension(ast, image_ext)
+            with io.open(json_file, "w", encoding="utf-8") as f:
+                f.write(json.dumps(ast, ensure_ascii=False))
 
-        # always build html doc
         build_cmd = " ".join([
             self.conf["pandoc_cmd"],
-            self.conf["pandoc_options_html"],
-            ' -V VERSION:"{0}" '.format(self.version()),
+            "-f json",
+            options,
+            ' -V VERSION:"{0}" '.format(doc_version),
             template,
-            file_list,
+            json_file,
             "-o",
-            out_file + ".html"])
-        self.cmd(build_cmd, cwd=pandoc_wd, verbose=verbose)
-
-        # build pdf in addition, if required (takes a lot longer)
-        if pdf:
-            # check if doc dir has tex template, if not use default
-            tex_template = path.abspath(
-                path.join(self.conf["doc_dir"], "templates", "default.tex"))
-            if path.isfile(tex_template):
-                template = ' --template=' + tex_template
-            else:
-                template = ' --template=' + \
-                    resource_filename(__name__, "templates/default.tex")
-
-            build_cmd = " ".join([
-                                 self.conf["pandoc_cmd"],
-                                 self.conf["pandoc_options_pdf"],
-                                 ' -V VERSION:"{0}" '.format(self.version()),
-                                 template,
-                                 file_list,
-                                 "-o",
-                                 out_file + ".pdf"])
-            self.cmd(build_cmd, cwd=pandoc_wd, verbose=verbose)
+            out_file + "." + fmt])
+        with self.metrics.phase("pandoc_" + fmt):
+            returncode, out, error = self.cmd(
+                build_cmd, cwd=path.join(self.out_dir, self.conf["in_dir"]),
+                verbose=verbose, env=env)
+        if returncode > 0:
+            self.errors.append("pandoc couldn't generate " + fmt + ": " + error.strip())
+        if json_file != source:
+            os.remove(json_file)
+        self._count_output(out_file + "." + fmt)
+
+    def _template(self, name):
+        """Returns the doc_dir's template if it has one, else the default"""
+        template = path.abspath(
+            path.join(self.conf["doc_dir"], "templates", name))
+        if path.isfile(template):
+            return template
+        return resource_filename(__name__, "templates/" + name)
+
+    def _count_output(self, out_file):
+        if path.isfile(out_file):
+            ext = path.splitext(out_file)[1][1:]
+            self.metrics.add("output." + ext, path.getsize(out_file))
 
     def clean(self, recreate_out=False):
         """Recreates out_dir"""
-        print("removing " + self.out_dir)
+        self.echo("removing " + self.out_dir)
         if path.isdir(self.out_dir):
             shutil.rmtree(self.out_dir)
-            print("removed")
+            self.echo("removed")
+        if self.staging_dir and path.isdir(path.dirname(self.staging_dir)):
+            shutil.rmtree(path.dirname(self.staging_dir))
         if recreate_out:
-            os.mkdir(self.out_dir)
+            os.makedirs(self.out_dir)
 
     def copy_dependencies(self, toc_lines):
         """Copies the contents of style_dir (e.g. css files) to out_dir.
         Chapters with images will have their images copied there as
         well, while preserving the chapter dir structure
         """
+        self._copy_styles()
+        self._copy_images(toc_lines)
+        shutil.copytree(self.in_dir, os.path.join(self.out_dir, self.conf["in_dir"]))
+
+    def copy_draft_dependencies(self, toc_lines, files):
+        """Like copy_dependencies, but only copies the given chapter files,
+        the templates they include and the images of the given chapters
+        """
+        self._copy_styles()
+        self._copy_images(toc_lines)
+
+        # pandoc runs in the copied in_dir and looks for images there
+        img_dir = self.conf["img_dir"]
+        for line in toc_lines:
+            if path.isdir(path.join(self.in_dir, line, img_dir)):
+                shutil.copytree(
+                    path.join(self.in_dir, line, img_dir),
+                    path.join(self.out_dir, self.conf["in_dir"], line, img_dir))
+
+        for source in self.referenced_sources(files):
+            target = path.join(self.out_dir, self.conf["in_dir"], source)
+            if not path.isdir(path.dirname(target)):
+                os.makedirs(path.dirname(target))
+            shutil.copy2(path.join(self.in_dir, source), target)
+
+    def referenced_sources(self, files):
+        """Returns files plus all templates they include, import or extend,
+        followed transitively
+        """
+        env = Environment(loader=FileSystemLoader(self.in_dir))
+        sources = set()
+        pending = list(files)
+        while pending:
+            source = pending.pop()
+            if source in sources:
+                continue
+            sources.add(source)
+            with io.open(path.join(self.in_dir, source), encoding='utf-8') as f:
+                ast = env.parse(f.read())
+            for ref in meta.find_referenced_templates(ast):
+                if ref is None:
+                    self.warn("Can't resolve dynamic include in " + source)
+                elif path.isfile(path.join(self.in_dir, ref)):
+                    pending.append(ref)
+        return sorted(sources)
+
+    def _copy_styles(self):
         if path.isdir(self.style_dir):
             shutil.copytree(
                 self.style_dir,
@@ -186,23 +645,25 @@ class Uberdoc:
                 resource_filename(__name__, "style"),
                 path.join(self.out_dir, self.conf["style_dir"]))
 
+    def _copy_images(self, toc_lines):
         for line in toc_lines:
             img_dir = self.conf["img_dir"]
             if path.isdir(path.join(self.in_dir, line, img_dir)):
-                os.mkdir(path.join(self.out_dir, line))
+                if not path.isdir(path.join(self.out_dir, line)):
+                    os.makedirs(path.join(self.out_dir, line))
 
                 shutil.copytree(
                     path.join(self.in_dir, line, img_dir),
                     path.join(self.out_dir, line, img_dir))
-
-        shutil.copytree(self.in_dir, os.path.join(self.out_dir, self.conf["in_dir"]))
-
+                for root, dirs, img_files in os.walk(path.join(self.out_dir, line, img_dir)):
+                    self.metrics.add("bytes.images", sum(
+                        path.getsize(path.join(root, f)) for f in img_files))
 
     def customize_templates(self):
         if path.isdir(self.template_dir):
             shutil.rmtree(self.template_dir)
 
-        print("Creating templates ...")
+        self.echo("Creating templates ...")
         shutil.copytree(
             resource_filename(__name__, "templates"),
             self.template_dir)
@@ -210,102 +671,292 @@ class Uberdoc:
         if path.isdir(self.style_dir):
             shutil.rmtree(self.style_dir)
 
-        print("Creating styles ...")
+        self.echo("Creating styles ...")
         shutil.copytree(
             resource_filename(__name__, "style"),
             self.style_dir)
 
     def read_toc(self):
-        """Reads the toc file containing the chapter list."""
+        """Reads the toc file containing the chapter list. Indented lines are
+        sub chapters living in a dir below their parent chapter's dir, so each
+        entry is returned as its path relative to in_dir, parents before
+        their children.
+        """
         toc_file = path.join(self.in_dir, self.conf["toc_filename"])
         try:
             with open(toc_file) as f:
                 lines = f.read().splitlines()
-            forced_lines = [line for line in lines if line.startswith("!")]
-            if len(forced_lines) > 0:
-                return [line[1:] for line in forced_lines]
-            else:
-                return [line for line in lines if not line.startswith("#")]
         except Exception:
-            cprint("Can't read " + toc_file, "red")
-            sys.exit(1)
+            raise UberdocError("Can't read " + toc_file)
+
+        entries = []
+        forced_entries = []
+        parents = []
+        for line in lines:
+            name = line.strip()
+            if not name or name.startswith("#"):
+                continue
+            indent = len(line.expandtabs(4)) - len(line.expandtabs(4).lstrip())
+            while parents and parents[-1][0] >= indent:
+                parents.pop()
+            forced = name.startswith("!")
+            if forced:
+                name = name[1:]
+            if parents:
+                name = parents[-1][1] + "/" + name
+            parents.append((indent, name))
+            entries.append(name)
+            if forced:
+                forced_entries.append(name)
+        return forced_entries if forced_entries else entries
+
+    def select_chapters(self, toc, patterns):
+        """Filters the toc down to the chapters matching any of the given
+        names or glob patterns, keeping toc order
+        """
+        selected = [entry for entry in toc
+                    if any(fnmatch.fnmatchcase(entry, p) or
+                           fnmatch.fnmatchcase(path.basename(entry), p)
+                           for p in patterns)]
+        if not selected:
+            raise UberdocError("No chapter in toc matches: " + " ".join(patterns))
+        return selected
 
     def outline(self, toc=None, delete=False):
         if toc is None:
             toc = self.read_toc()
+        chapter_dirs = self.scan_chapter_dirs(set(toc))
         for toc_entry in toc:
             chapter_dir = path.join(self.in_dir, toc_entry)
-            chapter_file = path.join(
-                chapter_dir, toc_entry + self.conf["input_ext"])
-            if not path.isdir(chapter_dir):
-                os.mkdir(chapter_dir)
-                cprint("Creating: " + toc_entry +
+            chapter_file = path.join(self.in_dir, self.chapter_file(toc_entry))
+            if toc_entry not in chapter_dirs:
+                os.makedirs(chapter_dir)
+                self.echo("Creating: " + toc_entry +
                        " -> " + chapter_file, "yellow")
                 with open(chapter_file, "w") as chapter_md:
-                    chapter_md.write("# " + toc_entry + "\n")
+                    chapter_md.write("# " + path.basename(toc_entry) + "\n")
             else:
-                cprint("Exists: " + toc_entry + " -> " + chapter_file, "green")
-        self._check_chapter_dirs(toc, delete)
-
-    def _check_chapter_dirs(self, toc, delete=False):
-        all_chapter_dirs = [name for name in os.listdir(self.in_dir)
-                            if os.path.isdir(os.path.join(self.in_dir, name))]
-        for chapter_dir_name in all_chapter_dirs:
-            if not chapter_dir_name in toc:
-                chapter_dir = path.join(self.in_dir, chapter_dir_name)
-                chapter_file = path.join(
-                    chapter_dir, chapter_dir_name + self.conf["input_ext"])
-                cprint(
-                    "Missing: " + chapter_dir_name + " -> " + chapter_file, "red")
-                if delete:
-                    should_remove = raw_input(
-                        "Remove " + chapter_dir_name + "? (y/N): ")
-                    if should_remove == "y":
-                        shutil.rmtree(chapter_dir)
-
-    def build(self, pdf=False, verbose=False):
-        """Calls all steps of the doc build process"""
-        print("Check environment ...")
-        self.check_env(verbose=verbose)
+                self.echo("Exists: " + toc_entry + " -> " + chapter_file, "green")
+        self._check_chapter_dirs(toc, delete, chapter_dirs)
+
+    def scan_chapter_dirs(self, toc_entries):
+        """Returns the paths of all chapter dirs below in_dir, relative to it.
+        Only dirs which are in toc_entries are descended into, so each dir
+        is listed once and stray dirs are reported without their contents.
+        Below the top level, a dir only counts as a chapter if it's in the
+        toc or has a chapter file, other dirs belong to their chapter (e.g.
+        diagrams or includes).
+        """
+        img_dir = self.conf["img_dir"]
+        chapter_dirs = set()
+        pending = [""]
+        while pending:
+            parent = pending.pop()
+            for name in _subdirs(path.join(self.in_dir, parent)):
+                if name == img_dir:
+                    continue
+                chapter_dir = parent + "/" + name if parent else name
+                if parent and chapter_dir not in toc_entries and \
+                        not path.isfile(path.join(self.in_dir, self.chapter_file(chapter_dir))):
+                    continue
+                chapter_dirs.add(chapter_dir)
+                if chapter_dir in toc_entries:
+                    pending.append(chapter_dir)
+        return chapter_dirs
+
+    def _check_chapter_dirs(self, toc, delete=False, chapter_dirs=None):
+        toc_entries = set(toc)
+        if chapter_dirs is None:
+            chapter_dirs = self.scan_chapter_dirs(toc_entries)
+        for chapter_dir_name in sorted(chapter_dirs - toc_entries):
+            chapter_dir = path.join(self.in_dir, chapter_dir_name)
+            chapter_file = path.join(
+                self.in_dir, self.chapter_file(chapter_dir_name))
+            self.echo(
+                "Missing: " + chapter_dir_name + " -> " + chapter_file, "red")
+            if delete:
+                should_remove = input(
+                    "Remove " + chapter_dir_name + "? (y/N): ")
+                if should_remove == "y":
+                    shutil.rmtree(chapter_dir)
+
+    def build(self, pdf=False, verbose=False, only=None):
+        """Calls all steps of the doc build process and returns a
+        BuildResult. If only is given, builds a draft of the toc chapters
+        matching those names or glob patterns.
+        """
+        with self._lock:
+            self.metrics = Metrics()
+            self.warnings = []
+            self.errors = []
+            target = self.draft() if only else self
+            with _build_lock(target.staging_dir):
+                try:
+                    self._build(target, pdf, verbose, only)
+                except Exception as e:
+                    msg = str(e) if isinstance(e, UberdocError) else \
+                        "Error: %s: %s" % (type(e).__name__, e)
+                    self.errors.append(msg)
+                    self.echo(msg, "red")
+                    return BuildResult([], self.metrics, self.warnings, self.errors)
+
+            self.record_stats("draft" if only else "full")
+            outputs = [path.join(target.out_dir, target.doc_filename + "." + fmt)
+                       for fmt in self.output_formats(pdf)]
+            if self.errors:
+                outputs = []
+            result = BuildResult([output for output in outputs if path.isfile(output)],
+                                 self.metrics, self.warnings, self.errors)
+        if result.ok:
+            self.echo("Done ...", "green")
+        else:
+            self.echo("Done with errors ...", "red")
+        return result
 
-        print("Cleaning ...")
-        self.clean(recreate_out=True)
+    def _build(self, target, pdf, verbose, only):
+        metrics = self.metrics
+        start = stats.timer()
 
-        print("Parse toc ...")
-        toc = self.read_toc()
+        self.echo("Check environment ...")
+        with metrics.phase("check"):
+            self.check_env(verbose=verbose)
 
-        print("Copy dependencies ...")
-        self.copy_dependencies(toc)
+        self.echo("Parse toc ...")
+        with metrics.phase("toc"):
+            toc = self.read_toc()
+            all_files = self.generate_file_list(toc)
+            if only:
+                toc = self.select_chapters(toc, only)
+                self.echo("Building draft of: " + ", ".join(toc))
+            staging = target.staging()
+            files = staging.generate_file_list(toc)
+        metrics.add("chapters", len(files))
+        self.check_formats(self.output_formats(pdf))
+
+        self.echo("Cleaning ...")
+        with metrics.phase("clean"):
+            staging.clean(recreate_out=True)
+
+        self.echo("Copy dependencies ...")
+        with metrics.phase("copy"):
+            if only:
+                staging.copy_draft_dependencies(toc, files)
+            else:
+                staging.copy_dependencies(toc)
+
+        self.echo("Preprocessing input files ...")
+        with metrics.phase("preprocess"):
+            staging.preprocess(files)
+
+        with metrics.phase("links"):
+            if only:
+                # links may point into chapters the draft doesn't contain
+                staging.index_chapters(all_files)
+            broken = staging.link_index().broken(files, all_files, self.in_dir)
+        for chapter, line, link, reason in broken:
+            self.warn("%s:%d: %s %s" % (chapter, line, reason, link))
+
+        self.echo("Generating document ...")
+        with metrics.phase("generate"):
+            staging.generate_doc(files, pdf=pdf, verbose=verbose)
+
+        for fmt in self.output_formats(pdf):
+            out_file = path.join(staging.out_dir, staging.doc_filename + "." + fmt)
+            if not self.errors and not path.isfile(out_file):
+                self.errors.append("pandoc didn't write " + out_file)
+
+        # a failed build leaves the last good document in place
+        if self.errors:
+            self.echo("Not publishing, " + target.out_dir + " is unchanged.", "red")
+        else:
+            self.echo("Publishing ...")
+            with metrics.phase("publish"):
+                keep = [] if only else [path.relpath(self.draft().out_dir, self.out_dir)]
+                target.publish(staging.out_dir, keep=keep)
 
-        print("Preprocessing input files ...")
-        files = self.generate_file_list(toc)
-        self.preprocess(files)
+        metrics.add("total", stats.timer() - start)
 
-        print("Generating document ...")
-        self.generate_doc(files, pdf=pdf, verbose=verbose)
+    def stats_file(self):
+        return self.prefix_path(self.conf.get("stats_file", ".udoc_stats.db"))
 
-        cprint("Done ...", "green")
+    def record_stats(self, kind):
+        """Appends the current build's metrics to the stats database. A
+        failure here is reported but doesn't fail the build.
+        """
+        try:
+            stats.record(self.stats_file(), self.metrics, kind, self.version())
+        except Exception as e:
+            self.warn("Couldn't record build stats: " + str(e))
+
+    def show_stats(self, last=10, baseline=20, draft=False):
+        """Prints build history, percentiles and regressed phases"""
+        if not path.isfile(self.stats_file()):
+            self.echo("No builds recorded yet.")
+            return
+        stats.report(self.stats_file(), self.echo, last=last, baseline=baseline,
+                     kind="draft" if draft else "full")
 
     def version(self):
         uberdoc_dir = path.abspath(self.conf["doc_dir"])
 
         git_dir = self._find_closest_git_dir(uberdoc_dir)
         if git_dir is None:
-            return datetime.datetime.now().strftime("%Y-%m-%d")
+            return self._input_date()
+        return self._git_info(uberdoc_dir, git_dir)[0]
 
+    def source_date_epoch(self):
+        """Returns the timestamp to embed in generated documents: the last
+        commit's time, or the newest input file's mtime outside of git
+        """
+        uberdoc_dir = path.abspath(self.conf["doc_dir"])
+        git_dir = self._find_closest_git_dir(uberdoc_dir)
+        epoch = git_dir and self._git_info(uberdoc_dir, git_dir)[1]
+        if not epoch:
+            epoch = self._input_epoch()
+        return int(epoch)
+
+    def _input_epoch(self):
+        """Returns the mtime of the newest file in in_dir"""
+        return int(max([os.stat(path.join(root, name)).st_mtime
+                        for root, dirs, names in os.walk(self.in_dir)
+                        for name in names] or [0]))
+
+    def _input_date(self):
+        """Returns the document version outside of git, the date of the
+        newest input file, so unchanged input keeps its version
+        """
+        return datetime.datetime.utcfromtimestamp(self._input_epoch()).strftime("%Y-%m-%d")
+
+    def _git_info(self, uberdoc_dir, git_dir):
+        git_state = (git_dir, self._mtime(path.join(git_dir, "HEAD")),
+                     self._mtime(path.join(git_dir, "logs", "HEAD")))
+        self.metrics.count_cache("version",
+            self._version is not None and self._version[0] == git_state)
+        if self._version is None or self._version[0] != git_state:
+            self._version = (git_state,) + self._git_version(uberdoc_dir, git_dir)
+        return self._version[1:]
+
+    def _git_version(self, uberdoc_dir, git_dir):
+        """Returns the document version and commit timestamp from git"""
         env = [("GIT_WORK_TREE", uberdoc_dir), ("GIT_DIR", git_dir)]
 
         returncode, version_str, error = self.cmd(
-            'git log -1 --format="%cd (%h)" --date=short',
+            'git log -1 --format="%ct %cd (%h)" --date=short',
             cwd=uberdoc_dir,
             env=env)
 
         if returncode > 0:
-            cprint("Current dir is not a git repository.", "yellow")
-            return datetime.datetime.now().strftime("%Y-%m-%d")
+            self.warn("Current dir is not a git repository.")
+            return (self._input_date(), None)
         else:
-            version_str = version_str.rstrip()
-            return version_str
+            epoch, version_str = version_str.rstrip().split(" ", 1)
+            return (version_str, int(epoch))
+
+    def _mtime(self, afile):
+        try:
+            return os.stat(afile).st_mtime
+        except OSError:
+            return None
 
     def _find_closest_git_dir(self, startdir):
         currentdir = path.abspath(startdir)
@@ -317,7 +968,7 @@ class Uberdoc:
 
     def git(self):
         """Turns the current dir into a git repo and adds default .gitignore"""
-        print("Initializing git repo in current dir and adding files ...")
+        self.echo("Initializing git repo in current dir and adding files ...")
         uberdoc_dir = self.conf["doc_dir"]
         env = [("GIT_WORK_TREE", uberdoc_dir),
                ("GIT_DIR", path.join(uberdoc_dir, ".git"))]
@@ -332,8 +983,8 @@ class Uberdoc:
 
     def show(self):
         file_html = path.join(
-            self.out_dir, self.conf["doc_filename"] + ".html")
-        file_pdf = path.join(self.out_dir, self.conf["doc_filename"] + ".pdf")
+            self.out_dir, self.doc_filename + ".html")
+        file_pdf = path.join(self.out_dir, self.doc_filename + ".pdf")
         # on windows this should be
         # os.startfile(file_html)
         self.cmd("open " + file_html)
@@ -344,35 +995,55 @@ class Uberdoc:
         """Generates an example in_dir dir structure, for new doc projects."""
         in_dir = self.in_dir
 
-        print("Copying default config file " + resource_filename(__name__, "uberdoc.cfg"))
+        self.echo("Copying default config file " + resource_filename(__name__, "uberdoc.cfg"))
         shutil.copyfile(
             resource_filename(__name__, "uberdoc.cfg"), self.prefix_path("uberdoc.cfg"))
 
-        print("Creating dir structure and sample chapters ...")
+        self.echo("Creating dir structure and sample chapters ...")
 
         shutil.copytree(
             resource_filename(__name__, "sample"),
             in_dir)
 
+    def check(self, verbose=True, links=False):
+        """Checks the environment and, if links is set, the document's
+        internal links and image references
+        """
+        self.check_env(verbose=verbose)
+        if not links:
+            return
+        broken = self.check_links()
+        for chapter, line, link, reason in broken:
+            self.echo("%s:%d: %s %s" % (chapter, line, reason, link), "red")
+        if broken:
+            raise UberdocError("Found %d broken links." % len(broken))
+        self.echo("All links ok.", "green")
+
     def check_env(self, verbose=True):
         def exit_if(condition, msg):
             if condition:
-                print(colored(msg, "red"))
-                sys.exit(1)
+                raise UberdocError(msg)
 
         if verbose:
-            cprint("Config settings: ", "yellow")
+            self.echo("Config settings: ", "yellow")
             if not self.isfile("uberdoc.cfg"):
-                print("No project specific config file. Using defaults.")
-            self.conf.show()
-            print("Document version: " + self.version())
+                self.echo("No project specific config file. Using defaults.")
+            for key, value in self.conf.items():
+                self.echo("  " + key + " = " + value)
+            self.echo("Document version: " + self.version())
+
+        tools = self.toolchain()
+        if verbose:
+            for name in ("pandoc", "git", "latex"):
+                self.echo("%s: %s (%s)" % (name, tools.path(name) or "not found",
+                                           tools[name]["version"] or "unknown version"))
 
         exit_if(
-            not distutils.spawn.find_executable(self.conf["pandoc_cmd"]),
+            not tools.path("pandoc"),
             "Error: Couldn't find pandoc in current path.")
 
         exit_if(
-            not distutils.spawn.find_executable("git"),
+            not tools.path("git"),
             "Error: Couldn't find git in current path.")
 
         exit_if(
@@ -386,7 +1057,45 @@ class Uberdoc:
             "Error: Couldn't find toc file. Was expecting: " + toc_file_path)
 
         if verbose:
-            cprint("Environment setup ok.", "green")
+            self.echo("Environment setup ok.", "green")
+
+    def toolchain(self):
+        """Returns the probed pandoc, git and LaTeX engine. The probe is
+        cached on disk and in the instance, and redone when PATH or one of
+        the executables changes.
+        """
+        pdf_options = self.conf.get("pandoc_options_pdf", "")
+        tools = {
+            "pandoc": self.conf["pandoc_cmd"],
+            "git": "git",
+            "latex": _option_value(pdf_options, "--pdf-engine") or
+                     _option_value(pdf_options, "--latex-engine") or "pdflatex",
+        }
+        key = toolchain.cache_key(tools)
+        if self._toolchain is not None and self._toolchain.key == key:
+            self.metrics.count_cache("toolchain", True)
+            return self._toolchain
+        cache_file = self.prefix_path(
+            self.conf.get("toolchain_cache_file", ".udoc_toolchain.json"))
+        try:
+            self._toolchain = toolchain.probe(tools, cache_file, key)
+        except (IOError, OSError):
+            self._toolchain = toolchain.probe(tools, key=key)
+        self.metrics.count_cache("toolchain", self._toolchain.cached)
+        return self._toolchain
+
+    def check_formats(self, formats):
+        """Raises an UberdocError if the toolchain can't write one of the
+        output formats
+        """
+        tools = self.toolchain()
+        for fmt in formats:
+            if not tools.supports_output(fmt):
+                raise UberdocError("Error: pandoc %s can't write %s." %
+                                   (tools["pandoc"]["version"], fmt))
+        if "pdf" in formats and not tools.path("latex"):
+            raise UberdocError("Error: Couldn't find LaTeX engine " +
+                               tools["latex"]["command"] + " for PDF output.")
 
     def prefix_path(self, *parts):
         return path.join(self.conf["doc_dir"], *parts)
@@ -398,10 +1107,26 @@ class Uberdoc:
         return path.isfile(self.prefix_path(afile))
 
 
-def main():
+def serve_daemon():
+    """Runs udoc daemon. The module is imported here, udoc's other commands
+    don't need it.
+    """
+    from . import daemon
+    daemon.serve()
+
+
+def load():
+    """Creates an Uberdoc instance for the document in the current dir"""
     conf = Config("uberdoc.cfg", defaults={"doc_dir": "."})
-    uberdoc = Uberdoc(conf)
+    return Uberdoc(conf)
+
+
+def main():
+    run(load(), sys.argv[1:])
 
+
+def run(uberdoc, argv):
+    """Parses the command line argv and runs it on the given instance"""
     parser = argparse.ArgumentParser(
         description="Wraps pandoc to create a writing environment for large documents.",
         epilog="Now start writing and stop messing with your tools!")
@@ -423,7 +1148,12 @@ def main():
     parser_check = subparsers.add_parser(
         "check",
         help="checks if your document environment is setup correctly")
-    parser_check.set_defaults(func=uberdoc.check_env)
+    parser_check.add_argument(
+        "-l",
+        "--links",
+        help="also checks internal links and image references",
+        action="store_true")
+    parser_check.set_defaults(func=uberdoc.check)
 
     parser_build = subparsers.add_parser(
         "build",
@@ -438,6 +1168,11 @@ def main():
         "--verbose",
         help="gives more details on what is happening during conversion",
         action="store_true")
+    parser_build.add_argument(
+        "--only",
+        nargs="+",
+        metavar="CHAPTER",
+        help="builds a draft of just these chapters (names or glob patterns)")
     parser_build.set_defaults(func=uberdoc.build)
 
     parser_git = subparsers.add_parser(
@@ -465,13 +1200,68 @@ def main():
         action="store_true")
     parser_outline.set_defaults(func=uberdoc.outline)
 
-    args = parser.parse_args()
-    if args.func == uberdoc.build:
-        uberdoc.build(pdf=args.pdf, verbose=args.verbose)
-    elif args.func == uberdoc.outline:
-        uberdoc.outline(delete=args.delete)
-    else:
-        args.func()
+    parser_stats = subparsers.add_parser(
+        "stats",
+        help="shows build history, timings and phases which got slower")
+    parser_stats.add_argument(
+        "-n",
+        "--last",
+        help="number of recent builds to list (default: 10)",
+        type=int,
+        default=10)
+    parser_stats.add_argument(
+        "-b",
+        "--baseline",
+        help="number of earlier builds to compare the last 5 against (default: 20)",
+        type=int,
+        default=20)
+    parser_stats.add_argument(
+        "--draft",
+        help="shows draft builds (build --only) instead of full builds",
+        action="store_true")
+    parser_stats.set_defaults(func=uberdoc.show_stats)
+
+    parser_profile = subparsers.add_parser(
+        "profile",
+        help="shows which chapters, templates and macros take longest to preprocess")
+    parser_profile.add_argument(
+        "--only",
+        nargs="+",
+        metavar="CHAPTER",
+        help="profiles just these chapters (names or glob patterns)")
+    parser_profile.add_argument(
+        "-n",
+        "--limit",
+        help="number of entries to show per section (default: 20)",
+        type=int,
+        default=20)
+    parser_profile.set_defaults(func=uberdoc.profile_templates)
+
+    parser_daemon = subparsers.add_parser(
+        "daemon",
+        help="runs a build server which keeps documents loaded, other udoc "
+             "commands are passed to it while it runs")
+    parser_daemon.set_defaults(func=serve_daemon)
+
+    args = parser.parse_args(argv)
+    try:
+        if args.func == uberdoc.build:
+            result = uberdoc.build(pdf=args.pdf, verbose=args.verbose, only=args.only)
+            if not result.ok:
+                sys.exit(1)
+        elif args.func == uberdoc.outline:
+            uberdoc.outline(delete=args.delete)
+        elif args.func == uberdoc.profile_templates:
+            uberdoc.profile_templates(only=args.only, limit=args.limit)
+        elif args.func == uberdoc.check:
+            uberdoc.check(links=args.links)
+        elif args.func == uberdoc.show_stats:
+            uberdoc.show_stats(last=args.last, baseline=args.baseline, draft=args.draft)
+        else:
+            args.func()
+    except UberdocError as e:
+        cprint(str(e), "red")
+        sys.exit(1)
 
 
 if __name__ == "__main__":